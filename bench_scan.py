@@ -0,0 +1,218 @@
+### Benchmarks for filescan.py.
+### Times project discovery, the RCRD CPY scans and the end-to-end run against a local test tree
+### (see make_test_tree.py --synthetic). Directory listings and stats can be slowed down with
+### simulated_latency to mimic the SMB share, so scan strategies can be compared on one machine.
+
+### Example:
+# python make_test_tree.py --root /tmp/bench/test_dirs --synthetic
+# python bench_scan.py /tmp/bench/test_dirs --scandir-latency 0.002 --stat-latency 0.001
+
+import os, datetime, logging
+import argparse
+import contextlib
+import json
+import tempfile
+import time
+
+import filescan
+
+# filescan logs every modified file at INFO level, so the benchmark logs through its own logger
+log = logging.getLogger("bench_scan")
+
+
+class _SlowScandirIterator:
+    """Wraps an os.scandir iterator so that each entry's stat() call is delayed."""
+    def __init__(self, iterator, entry_stat_latency: float):
+        self._iterator = iterator
+        self._entry_stat_latency = entry_stat_latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._iterator.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _SlowDirEntry(next(self._iterator), self._entry_stat_latency)
+
+    def close(self):
+        self._iterator.close()
+
+
+class _SlowDirEntry:
+    """Wraps an os.DirEntry so that stat() is delayed. Everything else is passed through."""
+    def __init__(self, entry, entry_stat_latency: float):
+        self._entry = entry
+        self._entry_stat_latency = entry_stat_latency
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def __fspath__(self):
+        return self._entry.path
+
+    def stat(self, *args, **kwargs):
+        time.sleep(self._entry_stat_latency)
+        return self._entry.stat(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def simulated_latency(scandir_latency: float = 0.0, stat_latency: float = 0.0, entry_stat_latency: float = 0.0):
+    """Delays every os.scandir and os.stat call (and so os.path.isdir/exists) to mimic a network share."""
+    # scandir_latency is added to each directory listing and stat_latency to each os.stat call.
+    # entry_stat_latency is added to DirEntry.stat(). On Windows that information comes back with
+    # the listing, so it defaults to 0; set it to mimic shares where every file stat is a round trip.
+    # time.sleep releases the GIL, so threads wait in parallel as they would on the network.
+    real_scandir, real_stat = os.scandir, os.stat
+
+    def slow_scandir(path="."):
+        time.sleep(scandir_latency)
+        iterator = real_scandir(path)
+        return _SlowScandirIterator(iterator, entry_stat_latency) if entry_stat_latency else iterator
+
+    def slow_stat(path, *args, **kwargs):
+        time.sleep(stat_latency)
+        return real_stat(path, *args, **kwargs)
+
+    os.scandir, os.stat = slow_scandir, slow_stat
+    try:
+        yield
+    finally:
+        os.scandir, os.stat = real_scandir, real_stat
+
+
+def time_call(func, *args, **kwargs):
+    """Calls func and returns (result, seconds taken)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def normalise(master_dict: dict) -> dict:
+    """Sorts the paths in a master dictionary so results of different strategies can be compared."""
+    return {office: {d: {p: sorted(paths) for p, paths in projects.items()} for d, projects in discs.items()}
+            for office, discs in master_dict.items()}
+
+
+def run_lazy(root: str, offices: list, disciplines: list, cutoff_date, workers: int = 1, **kwargs) -> dict:
+    """Runs a lazy scan (see filescan.lazy_scan), with discovery and the scan as one pipeline, and returns the master dictionary."""
+    records = filescan.walk_project_tree(root, offices, {}, disciplines, workers, lazy=True)
+    master_dict = filescan.new_master_dict(offices, disciplines)
+    for result in filescan.iter_record_scan_results(records, offices, disciplines, cutoff_date, workers, lazy=True, **kwargs):
+        filescan.add_to_master_dict(master_dict, *result)
+    return master_dict
+
+
+def get_strategies(workers: list[int], index_path: str, prune_margin_days: float | None) -> dict[str, dict]:
+    """Returns the scan strategies to compare, as {name: keyword arguments for assemble_master_dict}."""
+    # Add new strategies here to compare them against the serial scan.
+    # "lazy": True runs the strategy as a lazy scan instead (see run_lazy).
+    strategies = {}
+    for n in workers:
+        strategies["serial" if n <= 1 else f"threads x{n}"] = {"workers": n}
+    strategies[f"processes x{max(workers)}"] = {"workers": max(workers), "use_processes": True}
+    strategies[f"lazy x{max(workers)}"] = {"workers": max(workers), "lazy": True}
+    # The first index run builds the index, the second shows the cost of an unchanged share
+    strategies["index (cold)"] = {"workers": max(workers), "scan_options": {"index_path": index_path}}
+    strategies["index (warm)"] = {"workers": max(workers), "scan_options": {"index_path": index_path}}
+    if prune_margin_days is not None:
+        strategies[f"prune {prune_margin_days}d"] = {"workers": max(workers),
+                                                    "scan_options": {"prune_margin_days": prune_margin_days}}
+    return strategies
+
+
+def run_benchmarks(root: str, offices: list, disciplines: list, days: float, workers: list[int],
+                   prune_margin_days: float | None = None, latency: dict | None = None) -> dict:
+    """Runs the benchmarks against the tree at root and returns the timings."""
+    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+    results = {"root": root, "offices": offices, "disciplines": disciplines, "days": days, "latency": latency or {}}
+
+    with tempfile.TemporaryDirectory() as tmp, simulated_latency(**(latency or {})):
+        # Discovery
+        project_dirs, seconds = time_call(filescan.get_project_dirs, root, offices, {})
+        results["get_project_dirs"] = seconds
+        n_projects = sum(len(dirs) for dirs in project_dirs.values())
+        log.info(f"get_project_dirs: {seconds:.2f}s for {n_projects} project directories")
+        # The first run with the topology cache builds it, the second answers from it
+        cache_path, filescan.topology_cache_path = filescan.topology_cache_path, os.path.join(tmp, "topology_cache.sqlite")
+        try:
+            for name in ["get_project_dirs (topology cache cold)", "get_project_dirs (topology cache warm)"]:
+                _, seconds = time_call(filescan.get_project_dirs, root, offices, {})
+                results[name] = seconds
+                log.info(f"{name}: {seconds:.2f}s")
+        finally:
+            filescan.topology_cache_path = cache_path
+
+        # The discovery main runs: each project folder is listed once for its sub-projects and disciplines
+        records, seconds = time_call(lambda: list(filescan.walk_project_tree(root, offices, {}, disciplines, max(workers))))
+        results["walk_project_tree"] = seconds
+        log.info(f"walk_project_tree: {seconds:.2f}s for {len(records)} project disciplines")
+
+        # scan_directory on its own, one tree at a time
+        tree_times = []
+        for record in records:
+            if record.discipline_dir is not None:
+                rcrd_cpy_dir = filescan.get_rcrd_cpy_dirs(os.path.basename(record.discipline_dir), record.project_dir)
+                if rcrd_cpy_dir:
+                    tree_times.append(time_call(filescan.scan_directory, rcrd_cpy_dir, cutoff_date)[1])
+        results["scan_directory"] = {
+            "trees": len(tree_times),
+            "total": sum(tree_times),
+            "mean": sum(tree_times) / len(tree_times) if tree_times else 0.0,
+            "max": max(tree_times, default=0.0),
+        }
+        log.info(f"scan_directory: {sum(tree_times):.2f}s over {len(tree_times)} trees")
+
+        # End to end (discovery + scan) for each strategy, through walk_project_tree and iter_record_scan_results
+        # as in main. Results are checked against the first strategy; pruning is expected to differ when old
+        # issue folders have late edits.
+        results["end_to_end"] = {}
+        reference = None
+        strategies = get_strategies(workers, os.path.join(tmp, "scan_index.sqlite"), prune_margin_days)
+        for name, kwargs in strategies.items():
+            if kwargs.pop("lazy", False):
+                master_dict, seconds = time_call(run_lazy, root, offices, disciplines, cutoff_date, **kwargs)
+            else:
+                master_dict, seconds = time_call(filescan.assemble_master_dict, root, offices, {}, disciplines,
+                                                 cutoff_date, **kwargs)
+            master_dict = normalise(master_dict)
+            if reference is None:
+                reference = master_dict
+            same = master_dict == reference
+            results["end_to_end"][name] = {"seconds": seconds, "matches_first": same}
+            log.info(f"end to end [{name}]: {seconds:.2f}s{'' if same else ' (results differ from the first strategy)'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark filescan.py against a local test tree.")
+    parser.add_argument("root", help="Projects tree to scan, e.g. one built with make_test_tree.py --synthetic")
+    parser.add_argument("--offices", nargs="+", default=["SSC", "GLC", "SYD"])
+    parser.add_argument("--disciplines", nargs="+", default=["CVL", "STR", "ARC"])
+    parser.add_argument("--days", type=float, default=filescan.days_threshold)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--prune-margin-days", type=float, default=None)
+    parser.add_argument("--scandir-latency", type=float, default=0.0, help="Seconds added to each directory listing")
+    parser.add_argument("--stat-latency", type=float, default=0.0, help="Seconds added to each os.stat call")
+    parser.add_argument("--entry-stat-latency", type=float, default=0.0, help="Seconds added to each DirEntry.stat call")
+    parser.add_argument("--output", help="Write the timings to this JSON file")
+    args = parser.parse_args()
+
+    # Only the benchmark timings are of interest, not every modified file found by filescan
+    logging.getLogger().setLevel(logging.WARNING)
+    log.setLevel(logging.INFO)
+    latency = {"scandir_latency": args.scandir_latency, "stat_latency": args.stat_latency,
+               "entry_stat_latency": args.entry_stat_latency}
+    results = run_benchmarks(args.root, args.offices, args.disciplines, args.days, args.workers,
+                             args.prune_margin_days, latency)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,19 @@
 import os, datetime, logging
-import pandas as pd
+import argparse
+import collections
+import contextlib
+import csv
+import fnmatch
 import json
-from typing import Any, Iterable
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import chain, islice, tee
+from typing import Any, Iterable, Iterator, NamedTuple
+import scan_history
+import scan_index
+import topology_cache
 
 # The purpose of this script is to show which disciplines on which projects have modified files
 # in their RCRD CPY directories within the last X days.
@@ -27,7 +39,57 @@ base_dir = r"\\adgce.local\projects" # C:\Users\frede\Desktop\projects\ADG QA Sc
 offices = ["SSC"]
 disciplines = ["CVL"]
 days_threshold = 18 # The script will check for files modified up to this many days in the past. 
+extra_days_thresholds = [] # e.g. [7, 30]. These windows are found in the same scan and written to recently_issued_folders_<N>d.csv and .json.
 ind_projects_to_scan = {"SSC": [], "SYD": ["27868", "24234"]}  # This can be used to specify individual projects to scan, if needed.
+discovery_concurrency = 16 # Number of directory listings run at the same time while looking for project folders.
+scan_workers = 16 # Number of RCRD CPY trees scanned at the same time. Set to 1 to scan one tree at a time.
+scan_use_processes = False # Use a process pool instead of a thread pool for the parallel scan.
+scan_index_path = None # e.g. "scan_index.sqlite". If set, only directories whose mtime changed since the last run are listed again.
+scan_index_refresh = False # Set to True (e.g. for a nightly run) to relist every directory and rebuild the index.
+topology_cache_path = None # e.g. "topology_cache.sqlite". If set, the office/project/discipline folder listings are cached between runs.
+topology_cache_ttl = 12 * 3600 # Seconds a cached listing is trusted as is. After that, it is relisted only if the folder's mtime has changed.
+prune_margin_days = None # e.g. 60. If set, subfolders named with a YYMMDD date (250722_01_IFC) older than the cutoff by more than this many days are skipped.
+exclude_folder_names = [] # e.g. ["archive", "SUPERSEDED*", "Photos"]. Subfolders whose name matches one of these patterns (ignoring case) are not scanned.
+exclude_folder_paths = [] # Regular expressions for folder paths relative to RCRD CPY, with / between folders (ignoring case), e.g. r"^[^/]+/Models$".
+max_scan_depth = None # e.g. 4. Folders more than this many levels below RCRD CPY are not scanned (1 = only its direct subfolders).
+include_file_extensions = None # e.g. [".pdf", ".dwg"]. If set, only files with these extensions are checked.
+exclude_file_extensions = [] # e.g. [".bak", ".tmp"]. Files with these extensions are not checked.
+check_pruned = False # If True, pruned folders are scanned in full afterwards to confirm none of them had recent changes.
+profile_path = "scan_profile.json" # Timings and filesystem call counts for the run are written here. Set to None to skip.
+profile_top_n = 10 # Number of slowest RCRD CPY trees listed at the end of the run.
+output_jsonl = None # e.g. "recently_issued_folders.jsonl". If set, each result row is also written to this file as a JSON line.
+listing_timeout = None # e.g. 30. Seconds a single directory listing may take before it is abandoned (and retried).
+tree_timeout = None # e.g. 600. Seconds a single RCRD CPY tree may take. Trees that run out of time are listed in incomplete_trees.csv.
+listing_retries = 2 # Number of times a listing that timed out or failed with a network error is tried again.
+listing_retry_backoff = 2 # Seconds to wait before the first retry. The wait doubles with each retry.
+activity_summaries = False # If True, matched folders also get the newest file, its time, and the number and size of recent files in the outputs.
+checkpoint_path = "scan_checkpoint.jsonl" # Each scanned RCRD CPY tree is recorded here, so an interrupted run can carry on with --resume. Set to None to skip.
+checkpoint_sync_seconds = 30 # How often the checkpoint is forced to disk. It is flushed after every tree regardless.
+lazy_scan = False # If True, project discovery and the scan run as one pipeline, a few folders at a time, so memory does not grow with the number of projects. CSV rows then come out per project rather than per discipline.
+json_empty_projects = True # Set to False to leave projects with no recently modified folders out of the JSON output (and the scan history).
+history_path = "scan_history.sqlite" # Each run's results are also stored here, to compare runs with scan_history.py. Set to None to skip.
+
+CSV_COLUMNS = ["Office", "Discipline", "Project Number", "Path"]
+SUMMARY_COLUMNS = ["Newest Modified", "Recent Files", "Recent Bytes", "Newest File"] # Added with activity_summaries
+
+# Filesystem calls made while discovering project directories. Discovery always runs in the main
+# process (possibly on several threads), so the counts are kept here behind a lock. Counts for the
+# RCRD CPY scans are returned in each tree's report instead, so that they survive a process pool.
+discovery_counts = collections.Counter()
+_discovery_counts_lock = threading.Lock()
+
+
+def count_discovery_calls(**counts: int):
+    """Adds to the filesystem call counts for project discovery."""
+    with _discovery_counts_lock:
+        discovery_counts.update(counts)
+
+
+def add_counts(report: dict | None, counts: dict):
+    """Adds the given counts to a scan report, if there is one."""
+    if report is not None:
+        for key, value in counts.items():
+            report[key] = report.get(key, 0) + value
 
 
 def get_office_dirs(base_dir: str, offices: list) -> dict:
@@ -51,6 +113,9 @@ def get_subdirectories(directory: str, filter_digits):
     Returns:
         list: A list of subdirectory paths.
     """
+    if topology_cache_path:
+        return get_cached_subdirectories(directory, filter_digits)
+    count_discovery_calls(scandir_calls=1)
     try:
         return [
             entry.path for entry in os.scandir(directory)
@@ -64,6 +129,28 @@ def get_subdirectories(directory: str, filter_digits):
         return []
 
 
+def get_cached_subdirectories(directory: str, filter_digits) -> list[str]:
+    """Returns the same list as get_subdirectories, answered from the topology cache where possible."""
+    counts = {}
+    try:
+        names = topology_cache.get_subdir_names(directory, topology_cache_path, topology_cache_ttl, counts)
+    except PermissionError:
+        logging.warning(f"Permission denied: {directory}, skipping.")
+        return []
+    except Exception as e:
+        logging.warning(f"Skipping {directory}: {e}")
+        return []
+    finally:
+        count_discovery_calls(**counts)
+    if names is None:
+        logging.warning(f"Skipping {directory}: directory not found")
+        return []
+    return [
+        os.path.join(directory, name) for name in names
+        if filter_digits is None or (name.isdigit() and len(name) == filter_digits)
+    ]
+
+
 def assemble_ind_project_dirs(base_dir: str, ind_projects_to_scan: dict) -> dict[str, list[str]]:
     """Returns a dictionary of individual project directories to scan."""
     # The input to this function is a base directory and a dictionary of individual projects to scan.
@@ -76,7 +163,15 @@ def assemble_ind_project_dirs(base_dir: str, ind_projects_to_scan: dict) -> dict
         for project_no in projects:
             project_group_no = f"{project_no[:2]}000"
             project_dir = os.path.join(office_dir, project_group_no, project_no)
-            if os.path.exists(project_dir):
+            if topology_cache_path:
+                counts = {}
+                exists = topology_cache.find_subdir(os.path.dirname(project_dir), project_no, topology_cache_path,
+                                                    topology_cache_ttl, counts)
+                count_discovery_calls(**counts)
+            else:
+                count_discovery_calls(exists_calls=1)
+                exists = os.path.exists(project_dir)
+            if exists:
                 ind_project_dirs[office].append(project_dir)
             else:
                 logging.warning(f"Project directory {project_dir} does not exist, skipping.")
@@ -122,85 +217,1021 @@ def get_project_dirs(base_dir: str, offices: list, ind_projects_to_scan: dict):
     for office, proj_dirs in project_dirs.items():
         sub_projects = []
         for proj_dir in proj_dirs:
-            with os.scandir(proj_dir) as entries:
-                for entry in entries:
-                    if entry.is_dir() and len(entry.name) == 9 and entry.name[-4] == ".":
-                        sub_project = entry.path
-                        sub_projects.append(sub_project)
+            sub_projects.extend(get_sub_project_dirs(proj_dir))
         if sub_projects:
             project_dirs[office].extend(sub_projects)    
     
     return project_dirs
 
 
-def get_rcrd_cpy_dirs(discipline: str, project_dir: str):
+def is_sub_project_dir(path: str) -> bool:
+    """Returns True for a sub-project folder name or path, e.g. 27170.001."""
+    name = os.path.basename(path)
+    return len(name) == 9 and name[-4] == "."
+
+
+def get_sub_project_dirs(proj_dir: str) -> list[str]:
+    """Returns the sub-project directories (e.g. 27170\\27170.001) inside a project directory."""
+    if topology_cache_path:
+        return [path for path in get_cached_subdirectories(proj_dir, None) if is_sub_project_dir(path)]
+    count_discovery_calls(scandir_calls=1)
+    with os.scandir(proj_dir) as entries:
+        return [entry.path for entry in entries if entry.is_dir() and is_sub_project_dir(entry.name)]
+
+
+class ProjectDiscipline(NamedTuple):
+    """One requested discipline of one project or sub-project, as found by walk_project_tree."""
+    office: str                 # e.g. SSC
+    group: str                  # e.g. 27000
+    project: str                # e.g. 27170
+    sub_project: str | None     # e.g. 27170.001, or None for the project folder itself
+    discipline: str             # The discipline as requested, e.g. CVL
+    project_dir: str
+    discipline_dir: str | None  # The discipline folder as named on the share, or None if the project has none
+
+
+def get_scan_offices(offices: list, ind_projects_to_scan: dict) -> list[str]:
+    """Returns the offices in the order they appear in the output: scanned offices, then offices with individual projects."""
+    return list(offices) + [office for office in ind_projects_to_scan if office not in offices]
+
+
+def walk_project_tree(base_dir: str, offices: list, ind_projects_to_scan: dict, disciplines: list,
+                      max_concurrency: int = 16, lazy: bool = False,
+                      office_groups: dict[str, list[str]] | None = None) -> Iterator[ProjectDiscipline]:
+    """Yields a ProjectDiscipline record for every requested discipline of every project and sub-project."""
+    # The input to this function is the same as get_project_dirs, plus the disciplines to scan.
+    # Each project (and sub-project) folder is listed once. That one listing gives both its sub-projects
+    # and its discipline folders, which are matched against all requested disciplines at once, ignoring
+    # case. Projects without a folder for a discipline get a record with discipline_dir None, so they
+    # still appear (empty) in the output, as before.
+    # Records come out in the order of get_project_dirs: per office, the projects in the project groups,
+    # then the individual projects, then the sub-projects. Listings run on max_concurrency threads.
+    # If lazy is True, folders are only listed a few at a time ahead of the records being used, and
+    # sub-projects come straight after their project, so nothing is held for a whole office.
+    # office_groups can limit an office to some of its project group folders, {office: [group directories]}
+    # (e.g. for one shard of scan_shards.py). Other offices are walked in full.
+    wanted = {discipline.casefold(): discipline for discipline in disciplines}
+    max_pending = max_concurrency * 4 if lazy else None
+
+    def list_project(group, project, proj_dir):
+        subdirs = get_subdirectories(proj_dir, None)
+        sub_projects = []
+        if lazy:
+            sub_projects = [(group, project, sub_dir, get_subdirectories(sub_dir, None))
+                            for sub_dir in subdirs if is_sub_project_dir(sub_dir)]
+        return group, project, proj_dir, subdirs, sub_projects
+
+    def list_sub_project(group, project, sub_dir):
+        return group, project, sub_dir, get_subdirectories(sub_dir, None)
+
+    def find_disciplines(subdirs):
+        found = {}
+        for path in subdirs:
+            name = os.path.basename(path)
+            if name.casefold() in wanted:
+                found[wanted[name.casefold()]] = path
+        return found
+
+    def iter_projects(office, executor):
+        """Yields (group, project, project_dir) for every project folder in the office."""
+        if office in offices:
+            group_dirs = (office_groups or {}).get(office)
+            if group_dirs is None:
+                group_dirs = get_subdirectories(os.path.join(base_dir, office), filter_digits=5)
+            group_projects = map_bounded(executor, get_subdirectories, ((group_dir, 5) for group_dir in group_dirs),
+                                         max_concurrency if lazy else None)
+            for group_dir, proj_dirs in zip(group_dirs, group_projects):
+                for proj_dir in proj_dirs:
+                    yield os.path.basename(group_dir), os.path.basename(proj_dir), proj_dir
+        if ind_projects_to_scan.get(office):
+            ind_project_dirs = assemble_ind_project_dirs(base_dir, {office: ind_projects_to_scan[office]})
+            for proj_dir in ind_project_dirs[office]:
+                yield os.path.basename(os.path.dirname(proj_dir)), os.path.basename(proj_dir), proj_dir
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for office in get_scan_offices(offices, ind_projects_to_scan):
+            sub_projects = []
+            for group, project, proj_dir, subdirs, listed_sub_projects in map_bounded(
+                executor, list_project, iter_projects(office, executor), max_pending
+            ):
+                if not lazy:
+                    sub_projects.extend((group, project, path) for path in subdirs if is_sub_project_dir(path))
+                found = find_disciplines(subdirs)
+                for discipline in disciplines:
+                    yield ProjectDiscipline(office, group, project, None, discipline, proj_dir, found.get(discipline))
+                for _, _, sub_dir, sub_subdirs in listed_sub_projects:
+                    found = find_disciplines(sub_subdirs)
+                    for discipline in disciplines:
+                        yield ProjectDiscipline(office, group, project, os.path.basename(sub_dir), discipline, sub_dir,
+                                                found.get(discipline))
+
+            # Sub-projects are listed for their discipline folders only
+            for group, project, sub_dir, subdirs in map_bounded(executor, list_sub_project, sub_projects):
+                found = find_disciplines(subdirs)
+                for discipline in disciplines:
+                    yield ProjectDiscipline(office, group, project, os.path.basename(sub_dir), discipline, sub_dir,
+                                            found.get(discipline))
+
+
+def get_rcrd_cpy_dirs(discipline: str, project_dir: str, report: dict | None = None):
     """Returns the RCRD CPY directory path if it exists."""
     # The input to this function is a single discipline and a single project directory
     # This function will return the directory for the RCRD CPY folder in the project directory.
     # The directory will be of the form \\adgce.local\projects\SSC\25000\25633\CVL\RCRD CPY
     # The function will also check if the RCRD CPY directory exists. If not, it will return None.
+    # With the topology cache, the project and discipline folder listings are looked up in the cache
+    # instead. Filesystem call counts are added to the report dict if one is given.
     rcrd_cpy_dir = os.path.join(project_dir, discipline, "RCRD CPY")
-    return rcrd_cpy_dir if os.path.isdir(rcrd_cpy_dir) else None
+    if not topology_cache_path:
+        add_counts(report, {"isdir_calls": 1})
+        return rcrd_cpy_dir if os.path.isdir(rcrd_cpy_dir) else None
+    counts = {}
+    try:
+        exists = (
+            topology_cache.find_subdir(project_dir, discipline, topology_cache_path, topology_cache_ttl, counts)
+            and topology_cache.find_subdir(os.path.join(project_dir, discipline), "RCRD CPY",
+                                           topology_cache_path, topology_cache_ttl, counts)
+        )
+    except OSError as e:
+        logging.warning(f"Skipping {rcrd_cpy_dir}: {e}")
+        exists = False
+    add_counts(report, counts)
+    return rcrd_cpy_dir if exists else None
+
+
+def get_date_from_folder_name(name: str) -> datetime.date | None:
+    """Returns the date from the YYMMDD prefix of a folder name (e.g. 250722_01_IFC), or None if it has none."""
+    # The prefix must be exactly six digits, so numbers like 24324 or 2507221 are not mistaken for dates.
+    if len(name) < 6 or not name[:6].isdigit() or (len(name) > 6 and name[6].isdigit()):
+        return None
+    try:
+        return datetime.datetime.strptime(name[:6], "%y%m%d").date()
+    except ValueError:
+        return None
+
+
+def make_date_pruner(cutoff_date: datetime.datetime, margin_days: float, report: dict | None = None):
+    """Returns a function that tells whether a subfolder can be skipped because of the date in its name."""
+    # A folder is pruned if its name starts with a date more than margin_days before the cutoff date.
+    # The margin allows for late edits inside issue folders made after the date in their name.
+    # Pruned folders are added to report["pruned"] so they can be checked later.
+    prune_before = (cutoff_date - datetime.timedelta(days=margin_days)).date()
+    pruned = report.setdefault("pruned", []) if report is not None else None
+
+    def is_pruned(path: str) -> bool:
+        folder_date = get_date_from_folder_name(os.path.basename(path))
+        if folder_date is None or folder_date >= prune_before:
+            return False
+        logging.debug(f"Pruned by folder date: {path}")
+        if pruned is not None:
+            pruned.append(path)
+        return True
 
+    return is_pruned
 
-def scan_directory(rcrd_cpy_dir: str, cutoff_date: datetime.datetime) -> list:
-    """Scans the RCRD CPY directory for recently modified files and returns their directories."""
+
+class ScanRules:
+    """Exclusion rules for scan_directory, compiled once into regular expressions and sets."""
+    # folder_names are glob patterns (e.g. SUPERSEDED*) matched against each folder's name, and
+    # folder_paths are regular expressions searched for in each folder's path relative to RCRD CPY,
+    # written with / between folders. Both ignore case, as the share does.
+    # max_depth is the number of folder levels below RCRD CPY that are scanned.
+    # include_extensions and exclude_extensions decide which files are checked, by extension (e.g. .pdf).
+    def __init__(self, folder_names=(), folder_paths=(), max_depth=None, include_extensions=None,
+                 exclude_extensions=()):
+        self.folder_name_re = re.compile("|".join(fnmatch.translate(name) for name in folder_names),
+                                         re.IGNORECASE) if folder_names else None
+        self.folder_path_re = re.compile("|".join(f"(?:{path})" for path in folder_paths),
+                                         re.IGNORECASE) if folder_paths else None
+        self.max_depth = max_depth
+        self.include_extensions = frozenset(ext.lower() for ext in include_extensions) if include_extensions else None
+        self.exclude_extensions = frozenset(ext.lower() for ext in exclude_extensions or ())
+
+    def skip_folder(self, rel_path: str) -> str | None:
+        """Returns why a folder (given relative to RCRD CPY) is excluded, or None if it is scanned."""
+        rel_path = rel_path.replace(os.sep, "/")
+        if self.max_depth is not None and rel_path.count("/") + 1 > self.max_depth:
+            return "depth"
+        if self.folder_name_re and self.folder_name_re.match(rel_path.rsplit("/", 1)[-1]):
+            return "name"
+        if self.folder_path_re and self.folder_path_re.search(rel_path):
+            return "path"
+        return None
+
+    def skip_file(self, name: str) -> bool:
+        """Returns True if a file is not checked because of its extension."""
+        ext = os.path.splitext(name)[1].lower()
+        return ext in self.exclude_extensions or (self.include_extensions is not None and ext not in self.include_extensions)
+
+
+_compiled_scan_rules: dict[str, ScanRules] = {}
+
+
+def get_scan_rules(scan_rules: dict) -> ScanRules:
+    """Returns the compiled ScanRules for the given keyword arguments, compiling them only once per process."""
+    # The rules are passed around as plain settings so they can be sent to a process pool and stored
+    # in the checkpoint; the compiled rules are kept here.
+    key = json.dumps(scan_rules, sort_keys=True)
+    if key not in _compiled_scan_rules:
+        _compiled_scan_rules[key] = ScanRules(**scan_rules)
+    return _compiled_scan_rules[key]
+
+
+def get_configured_scan_rules() -> dict | None:
+    """Returns the exclusion rules set at the top of the script, as keyword arguments for ScanRules, or None if there are none."""
+    scan_rules = {"folder_names": exclude_folder_names, "folder_paths": exclude_folder_paths, "max_depth": max_scan_depth,
+                  "include_extensions": include_file_extensions, "exclude_extensions": exclude_file_extensions}
+    # A setting counts as set unless it is None or an empty list, so that max_scan_depth = 0 is not ignored
+    return scan_rules if any(value is not None and value != [] for value in scan_rules.values()) else None
+
+
+def get_scan_options() -> dict:
+    """Returns the scan_options (extra keyword arguments for scan_directory) set at the top of the script."""
+    return {
+        "index_path": scan_index_path,
+        "refresh_index": scan_index_refresh,
+        "prune_margin_days": prune_margin_days,
+        "summarise": activity_summaries,
+        "scan_rules": get_configured_scan_rules(),
+    }
+
+
+def scan_directory(rcrd_cpy_dir: str, cutoff_date: datetime.datetime | list[datetime.datetime],
+                   index_path: str | None = None, refresh_index: bool = False,
+                   prune_margin_days: float | None = None, summarise: bool = False, scan_rules: dict | None = None,
+                   report: dict | None = None) -> list:
+    """Scans the RCRD CPY directory for recently modified files and returns their directories.
+
+    If cutoff_date is a list of cutoff dates, the tree is still walked once, and one list of
+    directories is returned for each cutoff date."""
     # The input to this function is a single directory path to a RCRD CPY folder and a cutoff date.
     # This function will scan the RCRD CPY directory for files modified since the cutoff date.
     # If a file is found that meets the criteria, the directory containing the file will be added to the matching_dirs set.
     # The function will return a list of directories that contain modified files.
+    # If index_path is given, the scan is incremental: see scan_index.scan_directory_incremental.
+    # If prune_margin_days is given, dated subfolders well before the cutoff are skipped: see make_date_pruner.
+    # Details of the scan (e.g. pruned folders, filesystem call counts) are added to the report dict if one is given.
+    # If summarise is True, every file in a matched directory is checked rather than stopping at the first
+    # recent one, and report["summaries"] gets {directory: summary} for each matched directory, where the
+    # summary holds the newest file's mtime and name and the number and total size of recent files.
+    # This uses the stat data that os.scandir already has (on Windows it comes with the listing).
+    # With several cutoff dates, each directory's newest mtime is tracked until a file is found that is
+    # recent for every window; pruning and the index use the earliest cutoff date. The summaries count
+    # the recent files and bytes for the first cutoff date, and for each cutoff date in window_files
+    # and window_bytes (see get_summary_values).
+    # scan_rules holds keyword arguments for ScanRules. Excluded folders are never listed, and files
+    # excluded by extension are not checked. The number of each is added to the report
+    # (excluded_folders_by_<reason> and excluded_files). The scan index does not check extensions.
+
+    cutoff_dates = cutoff_date if isinstance(cutoff_date, list) else [cutoff_date]
+    earliest_cutoff = min(cutoff_dates)
+    is_pruned = make_date_pruner(earliest_cutoff, prune_margin_days, report) if prune_margin_days is not None else None
+    rules = get_scan_rules(scan_rules) if scan_rules else None
+    skip_file = rules.skip_file if rules else None
+
+    def skip_dir(path: str) -> bool:
+        if rules is not None:
+            reason = rules.skip_folder(path[len(rcrd_cpy_dir) + 1:])
+            if reason is not None:
+                logging.debug(f"Excluded by {reason}: {path}")
+                add_counts(report, {f"excluded_folders_by_{reason}": 1})
+                return True
+        return bool(is_pruned and is_pruned(path))
 
-    modified_dirs = set()
+    def split_windows(matched: dict) -> list:
+        # matched is {directory: newest mtime seen}, in traversal order
+        windows = [[path for path, mtime in matched.items() if mtime >= cutoff.timestamp()] for cutoff in cutoff_dates]
+        return windows if isinstance(cutoff_date, list) else windows[0]
+
+    # The tree gets tree_timeout seconds in all. A tree that runs out of time, or has directories that
+    # could not be listed in time, is recorded in report["incomplete"] with what was found so far.
+    deadline = time.monotonic() + tree_timeout if tree_timeout else None
+    timed_out = []
+
+    if index_path:
+        # The index's stats and listings get the same timeouts and retries. Once the tree is out of time,
+        # every further call fails straight away, so the directories left are recorded as timed out.
+        matched, counts = {}, {}
+        try:
+            scan_index.scan_directory_incremental(rcrd_cpy_dir, earliest_cutoff, index_path, refresh=refresh_index,
+                                                  skip_dir=skip_dir, report=report, newest_mtimes=matched,
+                                                  call=lambda func, *args: call_with_retries(deadline, counts, func, *args),
+                                                  timed_out=timed_out)
+        except Exception as e:
+            logging.warning(f"Skipping {rcrd_cpy_dir}: {e}")
+            matched = {}
+        finally:
+            add_counts(report, counts)
+        if timed_out and report is not None:
+            out_of_time = deadline is not None and time.monotonic() >= deadline
+            report.setdefault("incomplete", []).append({
+                "path": rcrd_cpy_dir,
+                "reason": "tree timeout" if out_of_time else "listing timeout",
+                "timed_out_dirs": timed_out,
+                "unscanned_dirs": 0,
+            })
+        return split_windows(matched)
+
+    modified_dirs = {} # {directory: newest mtime seen}, in traversal order
+    summaries = report.setdefault("summaries", {}) if summarise and report is not None else None
+    cutoff_ts = earliest_cutoff.timestamp()
+    all_windows_ts = max(cutoff_dates).timestamp() # A file this recent is recent in every window
+    window_ts = [cutoff.timestamp() for cutoff in cutoff_dates] if isinstance(cutoff_date, list) else None
+    counts = {"scandir_calls": 0, "stat_calls": 0, "dirs_visited": 0, "files_visited": 0,
+              "permission_denied": 0, "not_found": 0}
     stack = [rcrd_cpy_dir]
     try:
         while stack:
+            if deadline is not None and time.monotonic() >= deadline:
+                logging.warning(f"{rcrd_cpy_dir} took longer than {tree_timeout}s, {len(stack)} directories not scanned.")
+                break
             current_dir = stack.pop()
+            counts["dirs_visited"] += 1
             try:
-                with os.scandir(current_dir) as entries:
-                    for entry in entries:
-                        if entry.is_file():
-                            file_mod_time = datetime.datetime.fromtimestamp(entry.stat().st_mtime)
-                            if file_mod_time >= cutoff_date:
-                                modified_dirs.add(current_dir)
-                                logging.info(f"Modified file found: {entry.path}")
-                                # Do not continue scanning this directory if a modified file is found
-                                break
-                        elif entry.is_dir():
-                            stack.append(entry.path)
+                newest_mtime, newest_file, summary, subdirs = read_directory_with_retries(
+                    current_dir, deadline, counts, cutoff_ts, all_windows_ts, summaries is not None, skip_file, window_ts)
             except PermissionError:
                 logging.warning(f"Permission denied: {current_dir}, skipping.")
+                counts["permission_denied"] += 1
+                continue
             except FileNotFoundError:
                 logging.warning(f"Directory not found: {current_dir}, skipping.")
+                counts["not_found"] += 1
+                continue
+            except OSError as e:
+                # Timed out, or a network error that did not go away after the retries
+                logging.warning(f"Could not list {current_dir}, skipping: {e}")
+                timed_out.append(current_dir)
+                continue
+            if newest_mtime is not None:
+                logging.info(f"Modified file found: {newest_file}")
+                modified_dirs[current_dir] = newest_mtime
+                if summaries is not None:
+                    summaries[current_dir] = summary
+            stack.extend(path for path in subdirs if not skip_dir(path))
 
-        return list(modified_dirs)
+        if (stack or timed_out) and report is not None:
+            report.setdefault("incomplete", []).append({
+                "path": rcrd_cpy_dir,
+                "reason": "tree timeout" if stack else "listing timeout",
+                "timed_out_dirs": timed_out,
+                "unscanned_dirs": len(stack),
+            })
+        return split_windows(modified_dirs)
 
     except Exception as e:
         logging.warning(f"Skipping {rcrd_cpy_dir}: {e}")
-        return []
+        return split_windows({})
+    finally:
+        add_counts(report, counts)
+
+
+def read_scan_directory(directory: str, cutoff_ts: float, all_windows_ts: float, summarise: bool, skip_file=None,
+                        window_ts: list[float] | None = None):
+    """Lists one directory for scan_directory.
+
+    Returns (newest mtime, newest file, summary, subdirectories, counts), where the newest mtime and file are
+    for the files modified since cutoff_ts (None if there are none) and counts holds the filesystem calls made."""
+    # Files stop being checked once one is found that is at least as recent as all_windows_ts
+    # (see scan_directory), unless summarise is True, in which case the summary is filled in too.
+    # skip_file is an optional function that is given a file name and returns True to leave the file out.
+    # window_ts holds the cutoff timestamp of each window of a multi-window scan. The summary's recent
+    # files and bytes are then counted for the first window, and for every window in window_files and window_bytes.
+    # The subdirectories are sorted as in scan_index.list_directory_files, so a tree is walked, and its
+    # results come out, in the same order with or without the scan index.
+    counts = {"scandir_calls": 1, "stat_calls": 0, "files_visited": 0, "excluded_files": 0}
+    newest_mtime, newest_file = None, None
+    summary = {"newest_mtime": None, "recent_files": 0, "recent_bytes": 0, "newest_file": None} if summarise else None
+    if summarise and window_ts:
+        summary.update(window_files=[0] * len(window_ts), window_bytes=[0] * len(window_ts))
+    recent_ts = window_ts[0] if window_ts else cutoff_ts
+    subdirs = []
+    found = False
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                if skip_file and skip_file(entry.name):
+                    counts["excluded_files"] += 1
+                    continue
+                counts["files_visited"] += 1
+                if found and not summarise:
+                    continue
+                counts["stat_calls"] += 1
+                stat = entry.stat()
+                if summarise:
+                    if summary["newest_mtime"] is None or stat.st_mtime > summary["newest_mtime"]:
+                        summary["newest_mtime"], summary["newest_file"] = stat.st_mtime, entry.name
+                    if stat.st_mtime >= recent_ts:
+                        summary["recent_files"] += 1
+                        summary["recent_bytes"] += stat.st_size
+                    for i, ts in enumerate(window_ts or []):
+                        if stat.st_mtime >= ts:
+                            summary["window_files"][i] += 1
+                            summary["window_bytes"][i] += stat.st_size
+                if not found and stat.st_mtime >= cutoff_ts:
+                    if newest_mtime is None or stat.st_mtime > newest_mtime:
+                        newest_mtime, newest_file = stat.st_mtime, entry.path
+                    # Do not check any more files in this directory once a file is found that is
+                    # recent for every window (unless summarising), but keep collecting its
+                    # subdirectories so they are still scanned
+                    found = stat.st_mtime >= all_windows_ts
+            elif entry.is_dir():
+                subdirs.append(entry.path)
+    return newest_mtime, newest_file, summary, sorted(subdirs), counts
+
+
+def call_with_timeout(timeout: float | None, func, *args):
+    """Calls func(*args) and returns its result, or raises TimeoutError if it takes longer than timeout seconds."""
+    # The call runs on its own daemon thread, so a listing that hangs on an unresponsive share is left
+    # behind rather than holding up the scan, and does not stop Python from exiting either.
+    if timeout is None:
+        return func(*args)
+    if timeout <= 0:
+        raise TimeoutError("no time left")
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        raise TimeoutError(f"took longer than {timeout:.3g}s") from None
+
+
+def read_directory_with_retries(directory: str, deadline: float | None, counts: dict, *args):
+    """Calls read_scan_directory(directory, *args) within listing_timeout, retrying timeouts and network errors.
+
+    Returns (newest mtime, newest file, summary, subdirectories) and adds the filesystem calls made to counts.
+    deadline (from time.monotonic) is when the tree's time runs out, or None."""
+    *result, listing_counts = call_with_retries(deadline, counts, read_scan_directory, directory, *args)
+    add_counts(counts, listing_counts)
+    return tuple(result)
+
+
+def call_with_retries(deadline: float | None, counts: dict, func, *args):
+    """Calls func(*args) within listing_timeout, retrying timeouts and network errors, and returns its result.
+
+    Timeouts, errors and retries are added to counts. deadline is as for read_directory_with_retries."""
+    # A failed listing is tried again listing_retries times, waiting listing_retry_backoff seconds
+    # before the first retry and twice as long before each further one, as long as the tree has time left.
+    # PermissionError and FileNotFoundError are not retried.
+    attempt = 0
+    while True:
+        timeout = listing_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return call_with_timeout(timeout, func, *args)
+        except (PermissionError, FileNotFoundError, NotADirectoryError):
+            raise
+        except OSError as e:
+            add_counts(counts, {"listing_timeouts" if isinstance(e, TimeoutError) else "listing_errors": 1})
+            delay = listing_retry_backoff * 2 ** attempt
+            attempt += 1
+            if attempt > listing_retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                raise
+            logging.warning(f"Listing {args[0]} failed ({e}), retrying in {delay:g}s")
+            add_counts(counts, {"listing_retries": 1})
+            time.sleep(delay)
+
+
+def list_directory(directory: str) -> tuple[float | None, str | None, list[str]]:
+    """Lists a single directory and returns (newest file mtime, newest file path, [subdirectory paths])."""
+    # The newest file mtime and path are None if the directory holds no files.
+    # PermissionError and FileNotFoundError are left to the caller.
+    newest_mtime, newest_file = None, None
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                file_mtime = entry.stat().st_mtime
+                if newest_mtime is None or file_mtime > newest_mtime:
+                    newest_mtime, newest_file = file_mtime, entry.path
+            elif entry.is_dir():
+                subdirs.append(entry.path)
+    return newest_mtime, newest_file, subdirs
+
+
+def get_newest_mtimes(rcrd_cpy_dir: str, skip_dir=None) -> dict[str, float | None]:
+    """Walks a whole RCRD CPY tree and returns {directory: newest file mtime} for every directory in it."""
+    # Unlike scan_directory, every file is checked, so the result can answer any cutoff date afterwards.
+    # Directories without files map to None. Directories that cannot be listed are left out.
+    # skip_dir is an optional function that is given a subdirectory path and returns True to skip it.
+    newest_mtimes = {}
+    stack = [rcrd_cpy_dir]
+    while stack:
+        current_dir = stack.pop()
+        try:
+            newest_mtime, _, subdirs = list_directory(current_dir)
+        except PermissionError:
+            logging.warning(f"Permission denied: {current_dir}, skipping.")
+            continue
+        except FileNotFoundError:
+            logging.warning(f"Directory not found: {current_dir}, skipping.")
+            continue
+        newest_mtimes[current_dir] = newest_mtime
+        stack.extend(path for path in subdirs if not (skip_dir and skip_dir(path)))
+    return newest_mtimes
+
+
+def scan_project_record(record: ProjectDiscipline, cutoff_date: datetime.datetime,
+                        scan_options: dict | None = None) -> tuple[list, dict]:
+    """Finds the RCRD CPY directory for a record from walk_project_tree and scans it."""
+    # This is a single unit of work for the scan, so it can be handed to a thread or process pool.
+    # scan_options holds any extra keyword arguments for scan_directory.
+    # Returns the modified directories and the report for this tree. The report is returned rather
+    # than shared so that it also works from a process pool.
+    # The report's "trees" list holds one timing record for this unit, see write_scan_profile.
+    # The walker has already listed the project folder, so only projects that have a folder
+    # for the discipline are checked for a RCRD CPY directory.
+    start = time.perf_counter()
+    report = {}
+    rcrd_cpy_dir = None
+    if record.discipline_dir is not None:
+        rcrd_cpy_dir = get_rcrd_cpy_dirs(os.path.basename(record.discipline_dir), record.project_dir, report)
+    return scan_rcrd_cpy_dir(rcrd_cpy_dir, record.project_dir, record.discipline, cutoff_date, scan_options, report, start)
 
 
-def assemble_master_dict(disciplines: list, project_dirs: dict, cutoff_date) -> dict:
+def scan_rcrd_cpy_dir(rcrd_cpy_dir: str | None, proj_dir: str, discipline: str,
+                      cutoff_date: datetime.datetime | list[datetime.datetime],
+                      scan_options: dict | None, report: dict, start: float) -> tuple[list, dict]:
+    """Scans a RCRD CPY directory (if there is one) and adds the timing record for the tree to the report."""
+    # With a list of cutoff dates, the result holds one list of directories per cutoff date (see scan_directory).
+    if rcrd_cpy_dir:
+        mod_dirs = scan_directory(rcrd_cpy_dir, cutoff_date, report=report, **(scan_options or {})) # [\\adgce.local\projects\SSC\25000\25633\CVL\RCRD CPY\files]
+    else:
+        # print(f"No RCRD CPY directory found for {discipline} {proj_dir}"):
+        mod_dirs = [[] for _ in cutoff_date] if isinstance(cutoff_date, list) else []
+    report["trees"] = [{
+        "project_dir": proj_dir,
+        "discipline": discipline,
+        "has_rcrd_cpy": rcrd_cpy_dir is not None,
+        "seconds": time.perf_counter() - start,
+        "dirs_visited": report.get("dirs_visited", 0),
+        "files_visited": report.get("files_visited", 0),
+        "matches": max(map(len, mod_dirs), default=0) if isinstance(cutoff_date, list) else len(mod_dirs),
+    }]
+    return mod_dirs, report
+
+
+def merge_scan_report(report: dict, part: dict):
+    """Merges the report of a single scan into a combined report."""
+    # Lists are concatenated, numbers are added up and dicts are merged key by key.
+    # Anything else (e.g. the file name in an activity summary) is taken from the part.
+    for key, value in part.items():
+        if isinstance(value, list):
+            report.setdefault(key, []).extend(value)
+        elif isinstance(value, dict):
+            merge_scan_report(report.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            report[key] = report.get(key, 0) + value
+        else:
+            report[key] = value
+
+
+def fold_tree_records(report: dict, top_n: int):
+    """Keeps the timing records of the top_n slowest trees in the report and folds the others into totals."""
+    # Used by lazy scans, so the report does not grow with the number of trees scanned. The folded
+    # trees still count towards the number of trees and the seconds per discipline in the profile.
+    trees = report.get("trees", [])
+    if len(trees) <= top_n:
+        return
+    trees.sort(key=lambda tree: tree["seconds"], reverse=True)
+    folded = report.setdefault("folded_trees", {"trees": 0, "seconds_by_discipline": {}})
+    for tree in trees[top_n:]:
+        folded["trees"] += 1
+        seconds_by_discipline = folded["seconds_by_discipline"]
+        seconds_by_discipline[tree["discipline"]] = seconds_by_discipline.get(tree["discipline"], 0) + tree["seconds"]
+    del trees[top_n:]
+
+
+def check_pruned_folders(pruned: list, cutoff_date: datetime.datetime) -> dict[str, list]:
+    """Scans pruned folders in full and returns the ones that did contain recently modified files."""
+    # This is a safety check for the date pruning: any result here would have been missed by the scan.
+    missed = {}
+    for folder in pruned:
+        mod_dirs = scan_directory(folder, cutoff_date)
+        if mod_dirs:
+            logging.warning(f"Pruned folder {folder} has recently modified files in: {mod_dirs}")
+            missed[folder] = mod_dirs
+    return missed
+
+
+def iter_scan_results(base_dir: str, offices: list, ind_projects_to_scan: dict, disciplines: list, cutoff_date,
+                      workers: int = 1, use_processes: bool = False, scan_options: dict | None = None,
+                      report: dict | None = None) -> Iterable[tuple[str, str, str, list]]:
+    """Finds and scans every RCRD CPY tree and yields (office, discipline, project_number, [paths]) as each tree is done.
+
+    The projects are found with walk_project_tree and scanned with iter_record_scan_results, the same
+    as in main, so the results come out in the same order as the output files."""
+    records = list(walk_project_tree(base_dir, offices, ind_projects_to_scan, disciplines, discovery_concurrency))
+    return iter_record_scan_results(records, get_scan_offices(offices, ind_projects_to_scan), disciplines, cutoff_date,
+                                    workers, use_processes, scan_options, report)
+
+
+def sort_records(records: Iterable[ProjectDiscipline], offices: list, disciplines: list) -> list[ProjectDiscipline]:
+    """Returns the records from walk_project_tree in office -> discipline -> project order, the order of the output files."""
+    # The sort is stable, so within a discipline the projects keep the order of the walk
+    office_order = {office: i for i, office in enumerate(offices)}
+    discipline_order = {discipline: i for i, discipline in enumerate(disciplines)}
+    return sorted(records, key=lambda record: (office_order[record.office], discipline_order[record.discipline]))
+
+
+def checkpoint_key(record: ProjectDiscipline) -> str:
+    """Returns the key of a RCRD CPY tree in the checkpoint: office, discipline and project directory."""
+    return f"{record.office}|{record.discipline}|{record.project_dir}"
+
+
+class ScanCheckpoint:
+    """A checkpoint file that records each scanned RCRD CPY tree as a JSON line (see open_checkpoint)."""
+    def __init__(self, path: str, mode: str):
+        self.file = open(path, mode)
+        self.last_sync = time.monotonic()
+
+    def write(self, entry: dict):
+        # Flushed after every line so a stopped process loses nothing; forced to disk now and then
+        # so a crash or power cut loses at most checkpoint_sync_seconds of work.
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        if time.monotonic() - self.last_sync >= checkpoint_sync_seconds:
+            os.fsync(self.file.fileno())
+            self.last_sync = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+
+def open_checkpoint(path: str, settings: dict, scan_time: datetime.datetime,
+                    resume: bool = False) -> tuple[ScanCheckpoint, datetime.datetime, dict]:
+    """Opens the checkpoint for writing and returns (checkpoint, scan time, completed trees)."""
+    # The first line of the checkpoint holds the settings of the run and the time it started, which
+    # every window's cutoff date is measured back from, and each further line the results and report
+    # of one scanned RCRD CPY tree.
+    # If resume is True and the checkpoint was written with the same settings, it is appended to,
+    # and the scan time of the interrupted run and its completed trees are returned so that the
+    # output is the same as an uninterrupted run. Otherwise a new checkpoint is started for the
+    # given scan time and no trees are returned.
+    # Raises ValueError if resume is True but the checkpoint is for different settings.
+    settings = json.loads(json.dumps(settings)) # Compare as the checkpoint stores them, e.g. tuples as lists
+    if resume:
+        header, completed, valid_size = read_checkpoint(path)
+        if header is None:
+            logging.warning(f"No checkpoint found at {path}, starting a new scan.")
+        elif header["settings"] != settings:
+            raise ValueError(f"Checkpoint {path} was written with different settings, it cannot be resumed.")
+        else:
+            checkpoint = ScanCheckpoint(path, "a")
+            checkpoint.file.truncate(valid_size) # Drops a line that was only partly written when the run stopped
+            return checkpoint, datetime.datetime.fromisoformat(header["scan_time"]), completed
+    checkpoint = ScanCheckpoint(path, "w")
+    checkpoint.write({"format": "filescan-checkpoint", "settings": settings, "scan_time": scan_time.isoformat()})
+    return checkpoint, scan_time, {}
+
+
+def read_checkpoint(path: str) -> tuple[dict | None, dict, int]:
+    """Returns (settings line, {key: (mod_dirs, report)}, size of the complete lines) for a checkpoint file."""
+    # A run that is stopped while writing leaves a partial last line, which is ignored.
+    try:
+        with open(path, "rb") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None, {}, 0
+    header, completed, valid_size = None, {}, 0
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        if header is None:
+            if entry.get("format") != "filescan-checkpoint":
+                break
+            header = entry
+        else:
+            completed[entry["key"]] = (entry["mod_dirs"], entry["report"])
+        valid_size += len(line)
+    return header, completed, valid_size
+
+
+def iter_record_scan_results(records: Iterable[ProjectDiscipline], offices: list, disciplines: list, cutoff_date,
+                             workers: int = 1, use_processes: bool = False, scan_options: dict | None = None,
+                             report: dict | None = None, completed: dict | None = None,
+                             checkpoint: ScanCheckpoint | None = None, lazy: bool = False) -> Iterable[tuple[str, str, str, list]]:
+    """Scans the RCRD CPY tree of each record from walk_project_tree and yields
+    (office, discipline, project_number, [paths]) as each tree is done.
+
+    If workers is greater than 1, the RCRD CPY trees are scanned in parallel on a thread pool
+    (or a process pool if use_processes is True). Results are yielded in the same order as the
+    serial scan, so the output is identical either way.
+    scan_options holds any extra keyword arguments for scan_directory.
+    If a report dict is given, the reports of all scanned trees are merged into it.
+    offices gives the order of the offices in the output (see get_scan_offices).
+    completed holds the results of trees scanned by an earlier, interrupted run (see read_checkpoint).
+    These trees are not scanned again, their stored results are yielded in their place.
+    If a checkpoint (see open_checkpoint) is given, each newly scanned tree is recorded in it.
+    If lazy is True, records are scanned and yielded in the order they come in, a few at a time,
+    and the report only keeps the timing records of the slowest trees (see fold_tree_records)."""
+    # The records are put in office -> discipline -> project order (see sort_records), so results
+    # can be written out as soon as they arrive.
+    # The project numbers come from the records, so paths do not have to be parsed again.
+    completed = completed or {}
+    if lazy:
+        # The records are read once for the scan and once here; tee only holds the ones in between
+        units, scan_records = tee(records)
+        unit_args = ((record,) for record in scan_records if checkpoint_key(record) not in completed)
+        if completed:
+            logging.info(f"Resuming: {len(completed)} RCRD CPY trees already scanned")
+    else:
+        units = sort_records(records, offices, disciplines)
+        unit_args = [(record,) for record in units if checkpoint_key(record) not in completed]
+        if completed:
+            logging.info(f"Resuming: {len(units) - len(unit_args)} of {len(units)} RCRD CPY trees already scanned")
+    results = map_scan_units(scan_project_record, unit_args, cutoff_date, workers, use_processes, scan_options,
+                             max_pending=workers * 4 if lazy else None)
+    try:
+        for record in units:
+            key = checkpoint_key(record)
+            if key in completed:
+                mod_dirs, unit_report = completed[key]
+            else:
+                mod_dirs, unit_report = next(results)
+                if checkpoint is not None:
+                    checkpoint.write({"key": key, "mod_dirs": mod_dirs, "report": unit_report})
+            if report is not None:
+                merge_scan_report(report, unit_report)
+                if lazy:
+                    fold_tree_records(report, profile_top_n)
+            yield record.office, record.discipline, record.project, mod_dirs
+    finally:
+        results.close()
+
+
+def map_bounded(executor, func, args_iterable: Iterable[tuple], max_pending: int | None = None) -> Iterator:
+    """Yields func(*args) for each args in args_iterable, in order, with the calls run on the executor.
+
+    Unlike executor.map, args_iterable is only read as far as it is needed: at most max_pending calls
+    are submitted ahead of the result being yielded, so a lazy iterator is not read to the end up front
+    and finished results do not pile up. If max_pending is None, every call is submitted straight away."""
+    pending = collections.deque()
+    try:
+        for args in args_iterable:
+            pending.append(executor.submit(func, *args))
+            if max_pending is not None and len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def map_scan_units(scan_unit, unit_args: Iterable[tuple], cutoff_date, workers: int = 1, use_processes: bool = False,
+                   scan_options: dict | None = None, max_pending: int | None = None) -> Iterator[tuple[list, dict]]:
+    """Calls scan_unit(*args, cutoff_date, scan_options) for each unit's args and yields the results in order."""
+    # If workers is greater than 1, the units run on a thread pool (or a process pool if use_processes is True).
+    # Results are yielded in submission order, which keeps the output deterministic.
+    # unit_args can be a lazy iterator. If max_pending is set, it is read no more than max_pending
+    # units ahead of the results (see map_bounded).
+    trees = f"{len(unit_args)} RCRD CPY trees" if isinstance(unit_args, list) else "RCRD CPY trees as they are found"
+    unit_args = iter(unit_args)
+    first_units = list(islice(unit_args, 2))
+    if not first_units:
+        return
+    calls = ((*args, cutoff_date, scan_options) for args in chain(first_units, unit_args))
+    if workers > 1 and len(first_units) > 1:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        logging.info(f"Scanning {trees} with {workers} {'processes' if use_processes else 'threads'}")
+        executor = executor_class(max_workers=workers)
+        results = map_bounded(executor, scan_unit, calls, max_pending)
+    else:
+        executor = None
+        results = (scan_unit(*args) for args in calls)
+    try:
+        yield from results
+    finally:
+        results.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def iter_scan_rows(scan_results: Iterable[tuple[str, str, str, list]]) -> Iterable[tuple[str, str, str, str]]:
+    """Flattens scan results into (office, discipline, project_number, path) rows."""
+    for office, discipline, proj_no, mod_dirs in scan_results:
+        for path in mod_dirs:
+            yield office, discipline, proj_no, path
+
+
+def new_master_dict(offices: Iterable[str], disciplines: list) -> dict:
+    """Returns an empty master dictionary with an entry for each discipline in each office."""
+    return {office: {d: {} for d in disciplines} for office in offices}
+
+
+def add_to_master_dict(master_dict: dict, office: str, discipline: str, proj_no: str, mod_dirs: list):
+    """Adds the results of one RCRD CPY tree to the master dictionary."""
+    # Sub-projects (e.g. 24324.002 and 24324.003) share a project number, so their paths are combined.
+    bucket = master_dict[office][discipline].setdefault(proj_no, [])
+    bucket.extend(mod_dirs)
+
+
+def assemble_master_dict(base_dir: str, offices: list, ind_projects_to_scan: dict, disciplines: list, cutoff_date,
+                         workers: int = 1, use_processes: bool = False, scan_options: dict | None = None,
+                         report: dict | None = None) -> dict | list[dict]:
     """Assembles a master dictionary of directories for each office and discipline:
-    {office: {discipline: {project_number: [paths]}}}"""
-    # Set up master dictionary with empty lists for each discipline in each office
-    master_dict = {office: {d: {} for d in disciplines} for office in project_dirs.keys()}
+    {office: {discipline: {project_number: [paths]}}}
+
+    The arguments are the same as for iter_scan_results. If cutoff_date is a list of cutoff dates,
+    the share is scanned once and one master dictionary is returned for each cutoff date."""
+    cutoff_dates = cutoff_date if isinstance(cutoff_date, list) else [cutoff_date]
+    # Set up master dictionaries with empty lists for each discipline in each office
+    master_dicts = [new_master_dict(get_scan_offices(offices, ind_projects_to_scan), disciplines) for _ in cutoff_dates]
+    for office, discipline, proj_no, mod_dirs in iter_scan_results(base_dir, offices, ind_projects_to_scan, disciplines,
+                                                                   cutoff_date, workers, use_processes, scan_options,
+                                                                   report):
+        window_dirs = mod_dirs if isinstance(cutoff_date, list) else [mod_dirs]
+        for master_dict, dirs in zip(master_dicts, window_dirs):
+            add_to_master_dict(master_dict, office, discipline, proj_no, dirs)
+    return master_dicts if isinstance(cutoff_date, list) else master_dicts[0]
+
+
+def get_summary_values(summary: dict | None, window: int | None = None) -> list:
+    """Returns the SUMMARY_COLUMNS values for an activity summary (see scan_directory).
+
+    For the window-th window of a multi-window scan, the recent files and bytes are those of that window."""
+    if summary is None:
+        return [None] * len(SUMMARY_COLUMNS)
+    newest = datetime.datetime.fromtimestamp(summary["newest_mtime"]).isoformat(sep=" ", timespec="seconds")
+    if window is not None and "window_files" in summary:
+        return [newest, summary["window_files"][window], summary["window_bytes"][window], summary["newest_file"]]
+    return [newest, summary["recent_files"], summary["recent_bytes"], summary["newest_file"]]
+
+
+class ScanResultWriter:
+    """Writes the results of one scan window to CSV (and optionally JSONL) as they arrive, and the nested JSON at the end."""
+    # The master dictionary (see new_master_dict) is filled in as the results arrive.
+    # The CSV and JSONL files are flushed after every RCRD CPY tree, so partial results are on disk
+    # if the run is stopped. The nested JSON can only be written once every tree has been scanned,
+    # so it is written when the writer is closed without an error.
+    # If empty_projects is False, projects are only added to the master dictionary once they have a
+    # matched folder, so it holds the matches only.
+    # If summaries is given ({directory: activity summary}, filled in as the trees are scanned, see
+    # scan_directory), the SUMMARY_COLUMNS are added to each row, and each path in the nested JSON
+    # becomes an object holding the path and its summary columns. For a multi-window scan, window is the
+    # index of the writer's window, so its recent files and bytes are counted against its own cutoff date.
+    def __init__(self, master_dict: dict, csv_path: str, json_path: str, jsonl_path: str | None = None,
+                 summaries: dict | None = None, empty_projects: bool = True, window: int | None = None):
+        self.master_dict = master_dict
+        self.window = window
+        self.empty_projects = empty_projects
+        self.json_path = json_path
+        self.summaries = summaries
+        self.columns = CSV_COLUMNS + (SUMMARY_COLUMNS if summaries is not None else [])
+        self.n_rows = 0
+        self.csv_file = open(csv_path, "w", newline="")
+        self.jsonl_file = open(jsonl_path, "w") if jsonl_path else None
+        self.writer = csv.writer(self.csv_file, lineterminator="\n")
+        self.writer.writerow(self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.csv_file.close()
+        if self.jsonl_file:
+            self.jsonl_file.close()
+        if exc_type is None:
+            self.write_json()
+
+    def write(self, office: str, discipline: str, proj_no: str, mod_dirs: list):
+        """Adds the results of one RCRD CPY tree."""
+        if mod_dirs or self.empty_projects:
+            add_to_master_dict(self.master_dict, office, discipline, proj_no, mod_dirs)
+        rows = [(office, discipline, proj_no, path) for path in mod_dirs]
+        if not rows:
+            return
+        if self.summaries is not None:
+            rows = [row + tuple(get_summary_values(self.summaries.get(row[3]), self.window)) for row in rows]
+        self.writer.writerows(rows)
+        self.csv_file.flush()
+        if self.jsonl_file:
+            self.jsonl_file.writelines(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows)
+            self.jsonl_file.flush()
+        self.n_rows += len(rows)
+
+    def write_json(self):
+        master_dict = self.master_dict
+        if self.summaries is not None:
+            master_dict = {
+                office: {discipline: {proj_no: [
+                    dict(zip(["Path"] + SUMMARY_COLUMNS, [path] + get_summary_values(self.summaries.get(path), self.window)))
+                    for path in paths
+                ] for proj_no, paths in projects.items()} for discipline, projects in office_dict.items()}
+                for office, office_dict in master_dict.items()
+            }
+        with open(self.json_path, "w") as f:
+            json.dump(master_dict, f, indent=4)
+
+
+def write_scan_results(scan_results: Iterable[tuple[str, str, str, list]], master_dict: dict,
+                       csv_path: str, json_path: str, jsonl_path: str | None = None,
+                       summaries: dict | None = None, empty_projects: bool = True) -> int:
+    """Writes scan results to CSV (and optionally JSONL) as they arrive, and the nested JSON at the end."""
+    # The input to this function is an iterable of scan results (see iter_scan_results) and a master
+    # dictionary (see new_master_dict) that is filled in as the results arrive. See ScanResultWriter.
+    # Returns the number of rows written.
+    with ScanResultWriter(master_dict, csv_path, json_path, jsonl_path, summaries, empty_projects) as writer:
+        for office, discipline, proj_no, mod_dirs in scan_results:
+            writer.write(office, discipline, proj_no, mod_dirs)
+    return writer.n_rows
+
+
+def write_window_results(scan_results: Iterable[tuple[str, str, str, list]], writers: list[ScanResultWriter]) -> list[int]:
+    """Writes the results of a multi-window scan, where each result holds one list of paths per window.
+
+    writers holds one ScanResultWriter per window, in the same order as the scan's cutoff dates.
+    Returns the number of rows written for each window."""
+    with contextlib.ExitStack() as stack:
+        for writer in writers:
+            stack.enter_context(writer)
+        for office, discipline, proj_no, window_dirs in scan_results:
+            for writer, mod_dirs in zip(writers, window_dirs):
+                writer.write(office, discipline, proj_no, mod_dirs)
+    return [writer.n_rows for writer in writers]
+
+
+def get_window_path(path: str, days: float) -> str:
+    """Returns the output path for an extra scan window, e.g. recently_issued_folders_7d.csv."""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{days:g}d{ext}"
+
+
+def write_incomplete_trees(csv_path: str, incomplete: list[dict]):
+    """Writes the RCRD CPY trees that could not be scanned completely (see scan_directory) to a CSV file."""
+    # A file left by an earlier run is removed when every tree was scanned completely this time.
+    if not incomplete:
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+        return
+    logging.warning(f"{len(incomplete)} RCRD CPY trees could not be scanned completely, see {csv_path}.")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["Path", "Reason", "Timed Out Directories", "Unscanned Directories"])
+        writer.writerows(
+            [tree["path"], tree["reason"], ";".join(tree["timed_out_dirs"]), tree["unscanned_dirs"]] for tree in incomplete
+        )
+
+
+def write_scan_profile(profile_path: str, report: dict, discovery_seconds: float, scan_seconds: float,
+                       top_n: int = 10) -> dict:
+    """Writes the timings and filesystem call counts of a run to a JSON file and logs the slowest trees."""
+    # The input to this function is the merged report of all scanned trees (see iter_scan_results),
+    # and the time taken by project discovery and by the scan.
+    # Returns the profile that was written.
+    # After a lazy scan, only the slowest trees are listed (see fold_tree_records), so the slowest
+    # projects are worked out from those trees alone.
+    trees = report.get("trees", [])
+    folded = report.get("folded_trees", {})
+    seconds_by_discipline = collections.Counter(folded.get("seconds_by_discipline", {}))
+    seconds_by_project = collections.Counter()
+    for tree in trees:
+        seconds_by_discipline[tree["discipline"]] += tree["seconds"]
+        seconds_by_project[tree["project_dir"]] += tree["seconds"]
+    slowest_trees = sorted(trees, key=lambda tree: tree["seconds"], reverse=True)[:top_n]
+
+    profile = {
+        "generated": datetime.datetime.now().isoformat(timespec="seconds"),
+        "discovery": {"seconds": discovery_seconds, "counts": dict(discovery_counts)},
+        "scan": {
+            "seconds": scan_seconds,
+            "trees": len(trees) + folded.get("trees", 0),
+            # Numbers in the report are counts summed over all trees
+            "counts": {key: value for key, value in report.items() if isinstance(value, (int, float))},
+        },
+        "seconds_by_discipline": dict(seconds_by_discipline.most_common()),
+        "slowest_projects": dict(seconds_by_project.most_common(top_n)),
+        "slowest_trees": slowest_trees,
+        "trees": trees,
+    }
+    with open(profile_path, "w") as f:
+        json.dump(profile, f, indent=4)
+
+    logging.info(f"Discovery took {discovery_seconds:.1f}s, scan took {scan_seconds:.1f}s. Profile written to {profile_path}")
+    logging.info(f"Scan counts: {profile['scan']['counts']}")
+    logging.info(f"Slowest {len(slowest_trees)} RCRD CPY trees:")
+    for tree in slowest_trees:
+        logging.info(f"  {tree['seconds']:8.2f}s  {tree['dirs_visited']:6d} dirs  {tree['files_visited']:7d} files  "
+                     f"{tree['discipline']}  {tree['project_dir']}")
+    return profile
 
-    for office, proj_dirs in project_dirs.items():
-        for proj_dir in proj_dirs:
-            proj_no = get_project_number_from_path(proj_dir)
-            for discipline in disciplines:
-                rcrd_cpy_dir = get_rcrd_cpy_dirs(discipline, proj_dir) # Single directory as string
-                if rcrd_cpy_dir:
-                    mod_dirs = scan_directory(rcrd_cpy_dir, cutoff_date) # [\\adgce.local\projects\SSC\25000\25633\CVL\RCRD CPY\files]
-                    # print(f"Modified directories for {office} {discipline} {project_dir}: {mod_dirs}")
-                else:
-                    mod_dirs = []
-                    # print(f"No RCRD CPY directory found for {office} {discipline}"):
-                bucket = master_dict[office][discipline].setdefault(proj_no, [])
-                bucket.extend(mod_dirs)
-    return master_dict
 
 def master_dict_to_dataframe(master_dict: dict, level_names: list[str], path_col="Path"):
+    # pandas is only needed here, and takes a while to import, so it is not imported at the top of the script
+    import pandas as pd
+
     rows = []
 
     def walk(node, prefix):
@@ -235,6 +1266,13 @@ def get_project_number_from_path(path: str) -> str:
     # This function will return the project number as a string.
 
     parts = os.path.normpath(path).split(os.sep)
+    # A project folder sits in its project group (e.g. 18000\18123), and may be numbered like the group
+    # (18000\18000), so the folder after the first group folder is the project, as in walk_project_tree
+    for group, part in zip(parts, parts[1:]):
+        if group.isdigit() and len(group) == 5 and group[-3:] == "000" and part.isdigit() and len(part) == 5:
+            return part
+
+    # Otherwise, look for a single project-like number anywhere in the path
     parts_enum = enumerate(parts)
     might_be_project_number = []
     for i, part in parts_enum:
@@ -252,6 +1290,11 @@ def get_project_number_from_path(path: str) -> str:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Find recently modified folders in the RCRD CPY directories.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Carry on with an interrupted run, skipping the RCRD CPY trees in its checkpoint")
+    args = parser.parse_args()
+
     # clear command line
     os.system('cls' if os.name == 'nt' else 'clear')
 
@@ -261,24 +1304,118 @@ def main():
             logging.info(f"Removing '{office_key}' from ind_projects_to_scan because it's already in offices")
             ind_projects_to_scan.pop(office_key, None)
 
-    # Set the cutoff date for the scan
-    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days_threshold)
+    # Every window's cutoff date is measured back from the time the scan started
+    scan_time = datetime.datetime.now()
+
+    scan_options = get_scan_options()
+    if activity_summaries and scan_index_path:
+        logging.warning("Activity summaries are not available with the scan index, only matched folders are listed.")
+    if (include_file_extensions or exclude_file_extensions) and scan_index_path:
+        logging.warning("The scan index does not check file extensions, include_file_extensions and "
+                        "exclude_file_extensions are ignored. The folder exclusions still apply.")
+
+    # Record each scanned tree in the checkpoint. When resuming, the interrupted run's scan time is used.
+    checkpoint, completed = None, {}
+    if checkpoint_path:
+        settings = {"base_dir": base_dir, "offices": offices, "disciplines": disciplines,
+                    "ind_projects_to_scan": ind_projects_to_scan, "scan_options": scan_options,
+                    "days_threshold": days_threshold, "extra_days_thresholds": extra_days_thresholds}
+        try:
+            checkpoint, scan_time, completed = open_checkpoint(checkpoint_path, settings, scan_time, args.resume)
+        except ValueError as e:
+            logging.error(f"{e} Run without --resume to start again.")
+            return
+    elif args.resume:
+        logging.warning("checkpoint_path is not set, starting a new scan.")
 
-    # Get the project directories
-    project_dirs = get_project_dirs(base_dir, offices, ind_projects_to_scan)
+    # Any extra windows are measured back from the same moment as the main one, and found in the same scan
+    cutoff_date = scan_time - datetime.timedelta(days=days_threshold)
+    window_cutoffs = [cutoff_date] + [scan_time - datetime.timedelta(days=days) for days in extra_days_thresholds]
+    scan_cutoff = window_cutoffs if extra_days_thresholds else cutoff_date
+
+    # Find every discipline of every project and sub-project to scan
+    # In a lazy scan, the projects are found as the scan goes, so the discovery time is part of the scan time
+    start = time.perf_counter()
+    scan_offices = get_scan_offices(offices, ind_projects_to_scan)
+    records = walk_project_tree(base_dir, offices, ind_projects_to_scan, disciplines, discovery_concurrency, lazy=lazy_scan)
+    if not lazy_scan:
+        records = list(records)
+    discovery_seconds = time.perf_counter() - start
+
+    report = {}
+    scan_results = iter_record_scan_results(records, scan_offices, disciplines, scan_cutoff,
+                                            workers=scan_workers, use_processes=scan_use_processes,
+                                            scan_options=scan_options, report=report,
+                                            completed=completed, checkpoint=checkpoint, lazy=lazy_scan)
+
+    # Write the results to CSV as each RCRD CPY tree is scanned, and the raw master_dict to json at the end
+    # Each extra window gets its own set of outputs, e.g. recently_issued_folders_7d.csv
+    start = time.perf_counter()
+    # The summaries are merged into the report as each tree is scanned, before its results are written
+    summaries = report.setdefault("summaries", {}) if activity_summaries else None
+    # The results of the main window are recorded in the scan history as they are written
+    history = None
+    if history_path:
+        history = scan_history.HistoryRun(history_path, scan_time, cutoff_date, scan_offices, disciplines, summaries,
+                                          empty_projects=json_empty_projects)
+        scan_results = history.iter_recorded(scan_results, window=0 if extra_days_thresholds else None)
+    try:
+        if extra_days_thresholds:
+            writers = [ScanResultWriter(new_master_dict(scan_offices, disciplines), "recently_issued_folders.csv",
+                                        "recently_issued_folders.json", output_jsonl, summaries,
+                                        json_empty_projects)]
+            writers += [
+                ScanResultWriter(new_master_dict(scan_offices, disciplines),
+                                 get_window_path("recently_issued_folders.csv", days),
+                                 get_window_path("recently_issued_folders.json", days),
+                                 get_window_path(output_jsonl, days) if output_jsonl else None, summaries,
+                                 json_empty_projects, window)
+                for window, days in enumerate(extra_days_thresholds, start=1)
+            ]
+            window_rows = write_window_results(scan_results, writers)
+            n_rows = window_rows[0]
+            for days, rows in zip(extra_days_thresholds, window_rows[1:]):
+                logging.info(f"{rows} folders modified in the last {days:g} days.")
+        else:
+            n_rows = write_scan_results(scan_results, new_master_dict(scan_offices, disciplines),
+                                        "recently_issued_folders.csv", "recently_issued_folders.json",
+                                        jsonl_path=output_jsonl, summaries=summaries,
+                                        empty_projects=json_empty_projects)
+        if history is not None:
+            history.finish(n_rows)
+    except BaseException:
+        if checkpoint is not None:
+            logging.error(f"Scan interrupted. Run again with --resume to carry on from {checkpoint_path}.")
+        raise
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if history is not None:
+            history.close()
+    scan_seconds = time.perf_counter() - start
+    logging.info(f"{n_rows} recently modified folders found in the last {days_threshold:g} days.")
+    if checkpoint is not None:
+        os.remove(checkpoint_path) # The outputs are complete, so there is nothing left to resume
 
-    master_dict = assemble_master_dict(disciplines, project_dirs, cutoff_date)
+    if profile_path:
+        write_scan_profile(profile_path, report, discovery_seconds, scan_seconds, top_n=profile_top_n)
 
-    # Write raw master_dict results to json
-    with open("recently_issued_folders.json", "w") as f:
-        json.dump(master_dict, f, indent=4)
+    # Record which folders were skipped by the date pruning so they can be checked
+    pruned = report.get("pruned", [])
+    if prune_margin_days is not None:
+        logging.info(f"Pruned {len(pruned)} folders dated more than {prune_margin_days} days before the cutoff.")
+        with open("pruned_folders.txt", "w") as f:
+            f.writelines(f"{folder}\n" for folder in pruned)
+        if check_pruned:
+            missed = check_pruned_folders(pruned, min(window_cutoffs))
+            logging.info(f"{len(missed)} pruned folders had recently modified files.")
 
-    # Convert master_dict to a DataFrame
-    df = master_dict_to_dataframe(master_dict, level_names=["Office", "Discipline", "Project Number"], path_col="Path")
-    print(df)
+    excluded = {key: value for key, value in report.items() if key.startswith("excluded_") and value}
+    if excluded:
+        logging.info(f"Skipped by the exclusion rules: {excluded}")
 
-    # Write DataFrame to CSV
-    df.to_csv("recently_issued_folders.csv", index=False)
+    # List the trees that ran out of time, so they can be checked by hand or scanned again
+    write_incomplete_trees("incomplete_trees.csv", report.get("incomplete", []))
 
     logging.info("Scanning completed successfully. Results saved.")
 
@@ -1,9 +1,54 @@
-import os
+import os, logging
+import argparse
+import fnmatch
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import filescan
+import scan_index
+
+# Searching the share with os.walk lists every directory again for every search term, which takes
+# many minutes. Instead, the file names are kept in an index (a SQLite database) that is refreshed
+# from the share and then searched in milliseconds:
+# - Each directory path is stored once, and files refer to their directory by id.
+# - File names are indexed by trigram (SQLite FTS5), so substring searches do not scan every name.
+# - A refresh only lists directories whose mtime has changed since the last refresh.
+# The directories to index are found with the same office/project discovery as filescan.py.
+
+INDEX_PATH = "find_index.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT,
+    mtime REAL                  -- NULL until the directory has been listed successfully
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    dir_id INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir_id);
+"""
+
+# The trigram index over file names. It only holds the index, the names themselves stay in files.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, content='files', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+"""
+
 
 def find_files_containing_string(directory, search_string):
     """
     Search for files in the specified directory that contain a given string in their filenames.
-    
+
     :param directory: Directory to search in
     :param search_string: String that filenames should contain
     :return: List of file paths containing the specified string
@@ -15,18 +60,209 @@ def find_files_containing_string(directory, search_string):
         for filename in filenames:
             if search_string in filename:
                 matching_files.append(os.path.join(dirpath, filename))
-    
+
     return matching_files
 
+
+def open_index(index_path: str) -> sqlite3.Connection:
+    """Opens (and if needed creates) the file name index."""
+    conn = sqlite3.connect(index_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    try:
+        conn.executescript(FTS_SCHEMA)
+    except sqlite3.OperationalError as e:
+        # SQLite older than 3.34 has no trigram tokenizer; searches then scan every name
+        logging.warning(f"Trigram index not available ({e}), searches will be slower.")
+    return conn
+
+
+def has_trigram_index(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'").fetchone() is not None
+
+
+def get_index_roots(base_dir: str, offices: list) -> list[str]:
+    """Returns the project directories to index, found the same way as in filescan.py."""
+    # Sub-projects (e.g. 27170.001) are inside their project directory, so they are not separate roots.
+    project_dirs = filescan.get_project_dirs(base_dir, offices, {})
+    return [
+        proj_dir for proj_dirs in project_dirs.values() for proj_dir in proj_dirs
+        if "." not in os.path.basename(proj_dir)
+    ]
+
+
+def list_file_names(directory: str) -> tuple[list[str], list[str]]:
+    """Lists one directory for scan_index.walk_index: (subdirectories, file names)."""
+    names, subdirs = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                names.append(entry.name)
+            elif entry.is_dir():
+                subdirs.append(entry.path)
+    return sorted(subdirs), names
+
+
+def walk_changed_dirs(index_path: str, root: str, full: bool = False) -> tuple[list, list, list]:
+    """Walks one directory tree and returns what has changed since the index was last refreshed."""
+    # The walk is the same as the scan index's (see scan_index.walk_index): every directory is stat'ed,
+    # but only directories whose mtime differs from the index are listed, and a directory that cannot
+    # be stat'ed or listed is skipped. If full is True, every directory is listed. The index is only
+    # read here, so several trees can be walked at the same time; the changes are written by refresh_index.
+    # Returns (updated_dirs, new_children, removed_dirs):
+    # updated_dirs holds (path, parent, mtime, [file names]) for each directory that was listed,
+    # new_children holds (path, parent) for subdirectories not in the index yet,
+    # removed_dirs holds directories that no longer exist.
+    conn = sqlite3.connect(index_path, timeout=60)
+    updated_dirs, new_children, removed_dirs = [], [], []
+    try:
+        for current_dir, dir_mtime, names, _ in scan_index.walk_index(conn, root, list_file_names, refresh=full,
+                                                                      new_children=new_children,
+                                                                      removed_dirs=removed_dirs):
+            if names is not None:
+                updated_dirs.append((current_dir, os.path.dirname(current_dir), dir_mtime, names))
+    finally:
+        conn.close()
+    return updated_dirs, new_children, removed_dirs
+
+
+def delete_subtree(conn: sqlite3.Connection, path: str):
+    """Removes a directory, everything below it and their files from the index."""
+    low, high = scan_index.subtree_bounds(path)
+    subtree = "SELECT id FROM dirs WHERE path = ? OR (path >= ? AND path < ?)"
+    conn.execute(f"DELETE FROM files WHERE dir_id IN ({subtree})", (path, low, high))
+    conn.execute(f"DELETE FROM dirs WHERE id IN ({subtree})", (path, low, high))
+
+
+def refresh_index(index_path: str, roots: list[str], full: bool = False, workers: int = 8) -> dict:
+    """Brings the index up to date with the given directory trees and returns counts of what changed."""
+    # The trees are walked in parallel (see walk_changed_dirs) and their changes are written here,
+    # one tree at a time, from a single connection.
+    # Indexed trees that are not among the roots any more (e.g. a project folder that was removed from
+    # the share, so discovery no longer finds it) are removed from the index first.
+    conn = open_index(index_path)
+    counts = {"dirs_listed": 0, "files_indexed": 0, "dirs_removed": 0}
+    try:
+        # The top of each indexed tree is a directory whose parent is not in the index
+        current_roots = set(roots)
+        stale_roots = [
+            path for (path,) in conn.execute(
+                "SELECT path FROM dirs d WHERE NOT EXISTS (SELECT 1 FROM dirs p WHERE p.path = d.parent)"
+            ) if path not in current_roots
+        ]
+        with conn:
+            for path in stale_roots:
+                delete_subtree(conn, path)
+        counts["dirs_removed"] += len(stale_roots)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Only a few trees are walked ahead of the one being written, so their changes do not pile up
+            for root, (updated_dirs, new_children, removed_dirs) in zip(
+                roots, filescan.map_bounded(executor, walk_changed_dirs, ((index_path, root, full) for root in roots),
+                                            max_pending=workers * 2)
+            ):
+                with conn:
+                    for path in removed_dirs:
+                        delete_subtree(conn, path)
+                    # New subdirectories get a row with no mtime, so they are listed next time
+                    # even if this refresh could not reach them
+                    conn.executemany("INSERT OR IGNORE INTO dirs (path, parent) VALUES (?, ?)", new_children)
+                    for path, parent, dir_mtime, names in updated_dirs:
+                        conn.execute(
+                            "INSERT INTO dirs (path, parent, mtime) VALUES (?, ?, ?) "
+                            "ON CONFLICT (path) DO UPDATE SET parent = excluded.parent, mtime = excluded.mtime",
+                            (path, parent, dir_mtime),
+                        )
+                        (dir_id,) = conn.execute("SELECT id FROM dirs WHERE path = ?", (path,)).fetchone()
+                        conn.execute("DELETE FROM files WHERE dir_id = ?", (dir_id,))
+                        conn.executemany("INSERT INTO files (dir_id, name) VALUES (?, ?)", [(dir_id, name) for name in names])
+                        counts["files_indexed"] += len(names)
+                counts["dirs_listed"] += len(updated_dirs)
+                counts["dirs_removed"] += len(removed_dirs)
+                logging.debug(f"Refreshed {root}: {len(updated_dirs)} directories listed")
+    finally:
+        conn.close()
+    logging.info(f"Index refreshed: {counts}")
+    return counts
+
+
+def longest_literal(pattern: str, glob: bool) -> str:
+    """Returns the longest run of plain characters in a search term, used to look it up in the trigram index."""
+    if not glob:
+        return pattern
+    runs, run, in_class = [], "", False
+    for char in pattern:
+        if in_class:
+            in_class = char != "]"
+        elif char in "*?[":
+            runs.append(run)
+            run = ""
+            in_class = char == "["
+        else:
+            run += char
+    runs.append(run)
+    return max(runs, key=len)
+
+
+def name_matches(name: str, term: str, glob: bool, case_sensitive: bool) -> bool:
+    if not case_sensitive:
+        name, term = name.lower(), term.lower()
+    return fnmatch.fnmatchcase(name, term) if glob else term in name
+
+
+def search_index(index_path: str, terms: list[str], glob: bool = False, case_sensitive: bool = False,
+                 match_all: bool = False) -> list[str]:
+    """Returns the paths of indexed files whose names match the search terms."""
+    # By default a term matches file names that contain it, ignoring case. If glob is True, terms are
+    # shell-style patterns (e.g. *Jones*.pdf) matched against the whole name.
+    # Files matching any term are returned, or only files matching every term if match_all is True.
+    # Candidates are looked up in the trigram index with LIKE, which ignores case and treats % and _
+    # as wildcards, so it can only return too many names; the exact match is then checked here.
+    conn = open_index(index_path)
+    try:
+        candidate_sql = "SELECT f.id, d.path, f.name FROM files f JOIN dirs d ON d.id = f.dir_id"
+        use_trigrams = has_trigram_index(conn)
+        # Look up the most selective term first when every term has to match
+        lookup_terms = [max(terms, key=lambda term: len(longest_literal(term, glob)))] if match_all else terms
+        matches = {}
+        for term in lookup_terms:
+            literal = longest_literal(term, glob)
+            if use_trigrams and len(literal) >= 3:
+                rows = conn.execute(
+                    candidate_sql + " WHERE f.id IN (SELECT rowid FROM files_fts WHERE name LIKE ?)", (f"%{literal}%",)
+                )
+            else:
+                rows = conn.execute(candidate_sql + " WHERE f.name LIKE ?", (f"%{literal}%",))
+            for file_id, dir_path, name in rows:
+                checks = [name_matches(name, t, glob, case_sensitive) for t in terms]
+                if all(checks) if match_all else any(checks):
+                    matches[file_id] = os.path.join(dir_path, name)
+        return sorted(matches.values())
+    finally:
+        conn.close()
+
+
 if __name__ == "__main__":
-    # Define the directory to search and the string to look for in filenames
-    search_directory = "J:\\SSC"  # Update this path
-    search_string = 'Jones'  # Replace with the string you're searching for in filenames
+    parser = argparse.ArgumentParser(description="Search file names on the projects share using an index.")
+    parser.add_argument("terms", nargs="*", default=['Jones'], help="Strings (or patterns with --glob) to look for in file names")
+    parser.add_argument("--glob", action="store_true", help="Treat terms as shell-style patterns, e.g. *Jones*.pdf")
+    parser.add_argument("--case-sensitive", action="store_true")
+    parser.add_argument("--all", action="store_true", help="Only list files matching every term")
+    parser.add_argument("--refresh", action="store_true", help="Bring the index up to date before searching")
+    parser.add_argument("--full", action="store_true", help="With --refresh, list every directory again")
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--root", nargs="+", help="Index these directories instead of the filescan.py projects")
+    parser.add_argument("--base-dir", default=filescan.base_dir)
+    parser.add_argument("--offices", nargs="+", default=filescan.offices)
+    args = parser.parse_args()
+
+    if args.refresh or not os.path.exists(args.index):
+        roots = args.root or get_index_roots(args.base_dir, args.offices)
+        refresh_index(args.index, roots, full=args.full)
 
-    # Find and list files containing the specified string in their filenames
-    files = find_files_containing_string(search_directory, search_string)
+    # Find and list files matching the search terms
+    files = search_index(args.index, args.terms, glob=args.glob, case_sensitive=args.case_sensitive, match_all=args.all)
 
     # Output the found files
-    print(f"Files containing the string '{search_string}':")
+    print(f"Files matching {args.terms}:")
     for file in files:
-        print(file)
\ No newline at end of file
+        print(file)
@@ -1,6 +1,8 @@
 import os
 import shutil
 import datetime
+import random
+import argparse
 from pathlib import Path
 
 # -----------------------------------------------------------------------------
@@ -28,11 +30,20 @@ WIPE_EXISTING = True
 FILE_SCENARIOS = [
     ("",                 "readme.txt",              1),   # recent in root of RCRD CPY
     ("issued",           "package_list.txt",        3),   # recent in subfolder
-    ("issued\\drawings",  "sheet_register.txt",      10),  # older than a 4-day threshold
+    (os.path.join("issued", "drawings"), "sheet_register.txt", 10),  # older than a 4-day threshold
     ("WIP",              "notes.txt",               0),   # modified today
     ("archive",          "old_issue_log.txt",       30),  # old
 ]
 
+# Settings for the large synthetic tree (see generate_tree), used for benchmarking the scan.
+# Issue folders are named like the real ones, e.g. 250722_01_IFC or 250813_01_DESN INFO.
+ISSUE_TYPES = ["IFC", "IFA", "DESN INFO", "IFT", "PRELIM", "TENDER"]
+# Subfolders inside an issue folder that files are spread across ("" is the issue folder itself)
+ISSUE_SUBFOLDERS = ["", "PDF", "DWG", "QA", os.path.join("PDF", "SHEETS")]
+# Folders in RCRD CPY that are not issues
+OTHER_FOLDERS = ["CRNT", os.path.join("CRNT", "MODEL"), "SUPERSEDED"]
+FILE_EXTENSIONS = [".pdf", ".dwg", ".xlsx", ".docx", ".msg"]
+
 # -----------------------------------------------------------------------------
 # HELPERS
 # -----------------------------------------------------------------------------
@@ -84,15 +95,83 @@ def create_project_new(office_path: Path, group: str, project: str, sub_suffix:
             fpath = rcrd / subdir / fname
             create_file_with_mtime(fpath, days_ago, contents=f"{office_path.name}-{group}-{project}-{subproj}-{disc}")
 
+def set_mtime(path: Path, dt: datetime.datetime):
+    ts = dt.timestamp()
+    os.utime(path, (ts, ts))
+
+def create_rcrd_cpy(rcrd: Path, rng: random.Random, now: datetime.datetime, issues: int, files_per_issue: int,
+                    max_age_days: int, late_edit_fraction: float) -> int:
+    """
+    Fills a RCRD CPY folder with dated issue folders and returns the number of files created.
+    Each issue folder's files are dated around the date in its name. A fraction of files
+    (late_edit_fraction) are given a recent mtime instead, to mimic late edits in old issues.
+    """
+    n_files = 0
+    issues_per_day = {}
+    for _ in range(issues):
+        # Skew issue dates towards the recent past, like a live project
+        age = min(max_age_days, int(rng.expovariate(3.0 / max_age_days)))
+        issue_date = now - datetime.timedelta(days=age)
+        # Issues on the same day are numbered 01, 02, ...
+        day = f"{issue_date:%y%m%d}"
+        issues_per_day[day] = issues_per_day.get(day, 0) + 1
+        issue = rcrd / f"{day}_{issues_per_day[day]:02d}_{rng.choice(ISSUE_TYPES)}"
+        for file_no in range(files_per_issue):
+            fpath = issue / rng.choice(ISSUE_SUBFOLDERS) / f"{rcrd.parent.name}-{file_no:04d}{rng.choice(FILE_EXTENSIONS)}"
+            ensure_dir(fpath.parent)
+            fpath.touch()
+            if rng.random() < late_edit_fraction:
+                file_dt = now - datetime.timedelta(days=rng.uniform(0, 7))
+            else:
+                file_dt = min(now, issue_date + datetime.timedelta(hours=rng.uniform(0, 72)))
+            set_mtime(fpath, file_dt)
+            n_files += 1
+    for folder in OTHER_FOLDERS:
+        fpath = rcrd / folder / "placeholder.txt"
+        ensure_dir(fpath.parent)
+        fpath.touch()
+        set_mtime(fpath, now - datetime.timedelta(days=rng.uniform(0, max_age_days)))
+        n_files += 1
+    return n_files
+
+def generate_tree(root: str, offices=OFFICES, disciplines=DISCIPLINES, groups_per_office: int = 5,
+                  projects_per_group: int = 20, subproject_fraction: float = 0.2, rcrd_cpy_fraction: float = 0.7,
+                  issues_per_tree: int = 10, files_per_issue: int = 20, max_age_days: int = 3 * 365,
+                  late_edit_fraction: float = 0.02, seed: int = 0) -> int:
+    """
+    Builds a synthetic projects tree of any size under root and returns the number of files created.
+    The defaults give about 100k files. Layout per office:
+    OFFICE\\{group}\\{project}\\[{project}.{sub}\\]{discipline}\\RCRD CPY\\{issue folders}
+    Only rcrd_cpy_fraction of project disciplines get a RCRD CPY folder, so the scan also has to
+    deal with negative lookups. The same seed always gives the same tree layout.
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    n_files = 0
+    for office in offices:
+        for g in range(groups_per_office):
+            group = f"{18 + g:02d}000"
+            for p in range(projects_per_group):
+                project = f"{group[:2]}{p * 7 % 1000:03d}"
+                project_path = Path(root) / office / group / project
+                ensure_dir(project_path)
+                if rng.random() < subproject_fraction:
+                    parents = [project_path / f"{project}.{s:03d}" for s in range(1, rng.randint(1, 3) + 1)]
+                else:
+                    parents = [project_path]
+                for parent in parents:
+                    for disc in disciplines:
+                        ensure_dir(parent / disc)
+                        if rng.random() < rcrd_cpy_fraction:
+                            n_files += create_rcrd_cpy(parent / disc / "RCRD CPY", rng, now, issues_per_tree,
+                                                       files_per_issue, max_age_days, late_edit_fraction)
+    return n_files
+
 # -----------------------------------------------------------------------------
 # MAIN GENERATOR
 # -----------------------------------------------------------------------------
-def main():
-    # Optional wipe
-    if WIPE_EXISTING:
-        safe_wipe(ROOT)
-
-    root_path = Path(ROOT)
+def build_sample_tree(root: str):
+    root_path = Path(root)
     ensure_dir(root_path)
 
     for office in OFFICES:
@@ -114,7 +193,31 @@ def main():
             create_project_new(office_path, group="24000", project="24324", sub_suffix="002")
             create_project_new(office_path, group="24000", project="24324", sub_suffix="003")
 
-    print(f"Test directory tree created under:\n{ROOT}")
+def main():
+    parser = argparse.ArgumentParser(description="Create a test projects tree for filescan.py.")
+    parser.add_argument("--root", default=ROOT, help="Directory to create the tree in (must be named test_dirs)")
+    parser.add_argument("--synthetic", action="store_true", help="Build a large synthetic tree instead of the small sample tree")
+    parser.add_argument("--offices", nargs="+", default=OFFICES)
+    parser.add_argument("--groups", type=int, default=5, help="Project groups per office")
+    parser.add_argument("--projects", type=int, default=20, help="Projects per group")
+    parser.add_argument("--issues", type=int, default=10, help="Issue folders per RCRD CPY")
+    parser.add_argument("--files", type=int, default=20, help="Files per issue folder")
+    parser.add_argument("--max-age-days", type=int, default=3 * 365)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Optional wipe
+    if WIPE_EXISTING:
+        safe_wipe(args.root)
+
+    if args.synthetic:
+        n_files = generate_tree(args.root, offices=args.offices, groups_per_office=args.groups,
+                                projects_per_group=args.projects, issues_per_tree=args.issues,
+                                files_per_issue=args.files, max_age_days=args.max_age_days, seed=args.seed)
+        print(f"Synthetic tree with {n_files} files created under:\n{args.root}")
+    else:
+        build_sample_tree(args.root)
+        print(f"Test directory tree created under:\n{args.root}")
 
 if __name__ == "__main__":
     main()
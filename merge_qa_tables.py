@@ -7,19 +7,30 @@
 # 3 - Run this script to merge the two files into a new CSV file "merged_output.csv".
 # 4 - Copy the "merged output.csv" directories into the excel on teams.
 
-import pandas as pd
+from __future__ import annotations
+
 import os
+import csv
+import ntpath
 import openpyxl
 from openpyxl import load_workbook
 import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 MONTH = "Aug" # This will be used to read the correct tab from the Excel file.
+COMPARE_TABS = [MONTH] # Tabs to check for paths that are already on the tracking sheet, e.g. ["July", "Aug"].
+PATH_COLUMN = "Path"
+USE_PANDAS = False # Set to True to use the old pandas-based merge, which loads every tab in full.
 CSV_FILE_PATH = r"C:/Users/fsaniter/OneDrive - ADG/Desktop/Temp WIP Files/00_QA stuff/adg-qa-check/recently_issued_folders.csv"
 EXCEL_FILE_PATH = r"C:/Users/fsaniter/OneDrive - ADG/Desktop/Temp WIP Files/00_QA stuff/adg-qa-check/tmp_excel_for_merging.xlsx"
 NEW_CSV_FILE_PATH = r"C:/Users/fsaniter/OneDrive - ADG/Desktop/Temp WIP Files/00_QA stuff/adg-qa-check/merged_output.csv"
 
 def read_csv_file(file_path: str) -> pd.DataFrame:
     """Reads a CSV file and returns a DataFrame."""
+    import pandas as pd
     try:
         df = pd.read_csv(file_path)
         logging.info(f"CSV file read successfully: {df}")
@@ -30,6 +41,7 @@ def read_csv_file(file_path: str) -> pd.DataFrame:
     
 def read_excel_file(file_path: str, tab_name: str) -> pd.DataFrame:
     """Reads an Excel file and returns a DataFrame corresponding to the specified tab name."""
+    import pandas as pd
     try:
         df = pd.read_excel(file_path, sheet_name=tab_name)
         logging.info(f"Excel file read successfully: {df}")
@@ -41,6 +53,7 @@ def read_excel_file(file_path: str, tab_name: str) -> pd.DataFrame:
 
 def merge_dataframes(csv_df: pd.DataFrame, excel_df: pd.DataFrame) -> pd.DataFrame:
     """Merges the 2 dataframes into a new dataframes that contains only the rows from csv_df, in which the 'Path' column is not present in excel_df."""
+    import pandas as pd
     try:
         merged_df = csv_df[~csv_df['Path'].isin(excel_df['Path'])]
         logging.info(f"Dataframes merged successfully: {merged_df}")
@@ -58,6 +71,61 @@ def write_csv_file(file_path: str, df: pd.DataFrame):
         logging.error(f"Error writing CSV file: {e}")
     
 
+def normalise_path(path) -> str:
+    """Returns a path in a form that can be compared: one kind of slash, no trailing slash, case-folded."""
+    # Windows paths are case-insensitive, so "RCRD CPY\\250722_01_IFC\\" and "rcrd cpy/250722_01_ifc" are the same folder.
+    return ntpath.normpath(str(path).strip()).casefold()
+
+
+def read_excel_paths(file_path: str, tab_names: list[str], column: str = PATH_COLUMN) -> set[str]:
+    """Reads only the Path column from the given tabs of an Excel file and returns the normalised paths."""
+    # The workbook is opened read-only, so rows are streamed from the file instead of loaded all at once,
+    # and only the cells of the Path column are read. All tabs are read in one pass over the workbook.
+    paths = set()
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for tab_name in tab_names:
+            if tab_name not in workbook.sheetnames:
+                logging.warning(f"Tab {tab_name} not found in {file_path}, skipping.")
+                continue
+            sheet = workbook[tab_name]
+            header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            if column not in header:
+                logging.warning(f"No {column} column in tab {tab_name}, skipping.")
+                continue
+            col = header.index(column) + 1
+            n_paths = len(paths)
+            for (value,) in sheet.iter_rows(min_row=2, min_col=col, max_col=col, values_only=True):
+                if value is not None and str(value).strip():
+                    paths.add(normalise_path(value))
+            logging.info(f"Read {len(paths) - n_paths} new paths from tab {tab_name}")
+    finally:
+        workbook.close()
+    return paths
+
+
+def write_new_rows(csv_file_path: str, known_paths: set[str], new_csv_file_path: str, column: str = PATH_COLUMN) -> int | None:
+    """Streams the rows of a CSV file and writes the ones whose path is not in known_paths.
+
+    Returns the number of rows written, or None (and writes nothing) if the CSV file has no Path column."""
+    n_rows = 0
+    with open(csv_file_path, newline="") as f_in:
+        reader = csv.reader(f_in)
+        header = next(reader, [])
+        if column not in header:
+            logging.error(f"No {column} column in CSV file {csv_file_path}")
+            return None
+        col = header.index(column)
+        with open(new_csv_file_path, "w", newline="") as f_out:
+            writer = csv.writer(f_out, lineterminator="\n")
+            writer.writerow(header)
+            for row in reader:
+                if normalise_path(row[col]) not in known_paths:
+                    writer.writerow(row)
+                    n_rows += 1
+    return n_rows
+
+
 def main():
 
     month = MONTH
@@ -69,11 +137,18 @@ def main():
     new_csv_file_path = NEW_CSV_FILE_PATH
     excel_tab_name = month
 
-    csv_df = read_csv_file(csv_file_path)
-    excel_df = read_excel_file(excel_file_path, excel_tab_name)
+    if USE_PANDAS:
+        csv_df = read_csv_file(csv_file_path)
+        excel_df = read_excel_file(excel_file_path, excel_tab_name)
 
-    new_df = merge_dataframes(csv_df, excel_df)
-    write_csv_file(new_csv_file_path, new_df)
+        new_df = merge_dataframes(csv_df, excel_df)
+        write_csv_file(new_csv_file_path, new_df)
+    else:
+        known_paths = read_excel_paths(excel_file_path, COMPARE_TABS)
+        n_rows = write_new_rows(csv_file_path, known_paths, new_csv_file_path)
+        if n_rows is None:
+            return
+        logging.info(f"{n_rows} new paths not already in tabs {COMPARE_TABS}")
     logging.info(f"Output written to {new_csv_file_path}")
 
 
@@ -0,0 +1,343 @@
+### History of filescan.py runs.
+### Every run's results are stored in a SQLite database, keyed by run and folder path, so questions
+### across runs can be answered without reading the old CSV files again:
+# python scan_history.py runs                       (the stored runs)
+# python scan_history.py new                        (folders active in the latest run but not the one before)
+# python scan_history.py streak 3                   (folders active in each of the last 3 runs)
+# python scan_history.py trend 26921                (matched folders and recent files of a project, run by run)
+# python scan_history.py export 12                  (writes run 12 as recently_issued_folders.csv and .json)
+# python scan_history.py import old_csv/*.csv       (adds the CSV outputs of earlier runs to the history)
+
+import os, datetime, logging
+import argparse
+import csv
+import json
+import re
+import sqlite3
+import time
+
+HISTORY_PATH = "scan_history.sqlite"
+
+# Each folder path is stored once in paths, and results refer to it by id.
+# A run's units are its (office, discipline, project) scan results in the order they were written,
+# including those with no matched folders, so a run can be exported exactly as it was written.
+# Runs that were stopped before writing their outputs keep the status "running" and are left out of
+# the queries. Runs imported from old CSV files have the status "imported".
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,      -- ISO date and time the cutoff was measured back from
+    cutoff_date TEXT,           -- NULL for imported runs
+    offices TEXT,               -- JSON list
+    disciplines TEXT,           -- JSON list
+    summaries INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,       -- running, complete or imported
+    n_rows INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS units (
+    run_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    office TEXT NOT NULL,
+    discipline TEXT NOT NULL,
+    project TEXT NOT NULL,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS units_project ON units (project, run_id);
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,       -- the unit the folder was found in
+    path_id INTEGER NOT NULL,
+    newest_mtime REAL,          -- the activity summary columns, NULL if summaries were off
+    recent_files INTEGER,
+    recent_bytes INTEGER,
+    newest_file TEXT
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id, path_id);
+CREATE INDEX IF NOT EXISTS results_path ON results (path_id, run_id);
+"""
+
+# Only finished runs are compared
+FINISHED = "status IN ('complete', 'imported')"
+
+
+def open_history(history_path: str) -> sqlite3.Connection:
+    """Opens (and if needed creates) the scan history database."""
+    conn = sqlite3.connect(history_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def get_path_id(conn: sqlite3.Connection, path: str) -> int:
+    conn.execute("INSERT OR IGNORE INTO paths (path) VALUES (?)", (path,))
+    return conn.execute("SELECT id FROM paths WHERE path = ?", (path,)).fetchone()[0]
+
+
+class HistoryRun:
+    """Records the results of one filescan.py run in the scan history as they are written."""
+    # Results are committed every commit_seconds, so recording a run does not add a disk sync per
+    # RCRD CPY tree. The run is marked complete by finish(); until then it is left out of the queries.
+    # If empty_projects is False, trees without matched folders are not recorded, as in the run's JSON.
+    def __init__(self, history_path: str, started: datetime.datetime, cutoff_date: datetime.datetime | None,
+                 offices: list, disciplines: list, summaries: dict | None = None, status: str = "running",
+                 commit_seconds: float = 30, empty_projects: bool = True):
+        self.conn = open_history(history_path)
+        self.summaries = summaries
+        self.empty_projects = empty_projects
+        self.commit_seconds = commit_seconds
+        self.last_commit = time.monotonic()
+        self.seq = 0
+        with self.conn:
+            self.run_id = self.conn.execute(
+                "INSERT INTO runs (started, cutoff_date, offices, disciplines, summaries, status) VALUES (?, ?, ?, ?, ?, ?)",
+                (started.isoformat(timespec="seconds"), cutoff_date.isoformat(timespec="seconds") if cutoff_date else None,
+                 json.dumps(offices), json.dumps(disciplines), summaries is not None, status),
+            ).lastrowid
+
+    def add(self, office: str, discipline: str, proj_no: str, mod_dirs: list):
+        """Adds the results of one RCRD CPY tree."""
+        if not mod_dirs and not self.empty_projects:
+            return
+        self.seq += 1
+        self.conn.execute("INSERT INTO units (run_id, seq, office, discipline, project) VALUES (?, ?, ?, ?, ?)",
+                          (self.run_id, self.seq, office, discipline, proj_no))
+        for path in mod_dirs:
+            summary = self.summaries.get(path) if self.summaries is not None else None
+            values = [None] * 4 if summary is None else [summary["newest_mtime"], summary["recent_files"],
+                                                        summary["recent_bytes"], summary["newest_file"]]
+            self.conn.execute(
+                "INSERT INTO results (run_id, seq, path_id, newest_mtime, recent_files, recent_bytes, newest_file) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (self.run_id, self.seq, get_path_id(self.conn, path), *values)
+            )
+        if time.monotonic() - self.last_commit >= self.commit_seconds:
+            self.conn.commit()
+            self.last_commit = time.monotonic()
+
+    def iter_recorded(self, scan_results, window: int | None = None):
+        """Records scan results as they pass through to the writers, and yields them unchanged."""
+        # For a multi-window scan (see scan_directory), window is the index of the window to record.
+        for result in scan_results:
+            office, discipline, proj_no, mod_dirs = result
+            self.add(office, discipline, proj_no, mod_dirs if window is None else mod_dirs[window])
+            yield result
+
+    def finish(self, n_rows: int, status: str = "complete"):
+        """Marks the run as complete, once its outputs have been written."""
+        with self.conn:
+            self.conn.execute("UPDATE runs SET status = ?, n_rows = ? WHERE id = ?", (status, n_rows, self.run_id))
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def get_runs(history_path: str) -> list[tuple]:
+    """Returns (id, started, cutoff_date, status, n_rows) for every stored run, oldest first."""
+    conn = open_history(history_path)
+    try:
+        return conn.execute("SELECT id, started, cutoff_date, status, n_rows FROM runs ORDER BY started, id").fetchall()
+    finally:
+        conn.close()
+
+
+def get_finished_run_ids(conn: sqlite3.Connection, run_id: int | None, n: int) -> list[int]:
+    """Returns the ids of the n finished runs up to and including run_id (default: the latest), newest first."""
+    if run_id is None:
+        row = conn.execute(f"SELECT id FROM runs WHERE {FINISHED} ORDER BY started DESC, id DESC LIMIT 1").fetchone()
+        if row is None:
+            return []
+        run_id = row[0]
+    started = conn.execute("SELECT started FROM runs WHERE id = ?", (run_id,)).fetchone()
+    if started is None:
+        raise ValueError(f"No run {run_id} in the scan history")
+    rows = conn.execute(
+        f"SELECT id FROM runs WHERE {FINISHED} AND id != ? AND (started < ? OR (started = ? AND id < ?)) "
+        "ORDER BY started DESC, id DESC LIMIT ?", (run_id, started[0], started[0], run_id, n - 1)
+    )
+    return [run_id] + [row_id for (row_id,) in rows]
+
+
+def new_since_previous(history_path: str, run_id: int | None = None) -> list[tuple[str, str, str, str]]:
+    """Returns the (office, discipline, project, path) of folders matched in a run but not in the finished run before it."""
+    conn = open_history(history_path)
+    try:
+        run_ids = get_finished_run_ids(conn, run_id, 2)
+        if not run_ids:
+            return []
+        previous = run_ids[1] if len(run_ids) > 1 else -1
+        return conn.execute(
+            "SELECT u.office, u.discipline, u.project, p.path FROM results r "
+            "JOIN units u ON u.run_id = r.run_id AND u.seq = r.seq JOIN paths p ON p.id = r.path_id "
+            "WHERE r.run_id = ? AND NOT EXISTS (SELECT 1 FROM results o WHERE o.path_id = r.path_id AND o.run_id = ?) "
+            "ORDER BY r.seq, r.rowid", (run_ids[0], previous)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def active_in_consecutive_runs(history_path: str, n: int, run_id: int | None = None) -> list[str]:
+    """Returns the paths of folders matched in each of the last n finished runs (up to run_id)."""
+    conn = open_history(history_path)
+    try:
+        run_ids = get_finished_run_ids(conn, run_id, n)
+        if len(run_ids) < n:
+            return []
+        placeholders = ", ".join("?" * n)
+        return [path for (path,) in conn.execute(
+            f"SELECT p.path FROM results r JOIN paths p ON p.id = r.path_id WHERE r.run_id IN ({placeholders}) "
+            "GROUP BY r.path_id HAVING COUNT(DISTINCT r.run_id) = ? ORDER BY p.path", (*run_ids, n)
+        )]
+    finally:
+        conn.close()
+
+
+def project_trend(history_path: str, project: str, office: str | None = None,
+                  discipline: str | None = None) -> list[tuple]:
+    """Returns (run id, started, matched folders, recent files, recent bytes) for a project in every finished run."""
+    # The recent files and bytes are None for runs recorded without activity summaries.
+    conn = open_history(history_path)
+    try:
+        return conn.execute(
+            "SELECT runs.id, runs.started, COUNT(r.path_id), SUM(r.recent_files), SUM(r.recent_bytes) FROM runs "
+            "LEFT JOIN units u ON u.run_id = runs.id AND u.project = ? "
+            "AND (? IS NULL OR u.office = ?) AND (? IS NULL OR u.discipline = ?) "
+            "LEFT JOIN results r ON r.run_id = u.run_id AND r.seq = u.seq "
+            f"WHERE runs.{FINISHED} GROUP BY runs.id ORDER BY runs.started, runs.id",
+            (project, office, office, discipline, discipline),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def export_run(history_path: str, run_id: int, csv_path: str, json_path: str, jsonl_path: str | None = None) -> int:
+    """Writes a stored run as filescan.py's CSV, JSON (and optionally JSONL) outputs. Returns the number of rows."""
+    # The units are replayed through filescan's ScanResultWriter in their original order, so the
+    # files are the same as the ones the run wrote.
+    import filescan # filescan records its runs here, so it is imported when needed
+    conn = open_history(history_path)
+    try:
+        row = conn.execute("SELECT offices, disciplines, summaries FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"No run {run_id} in the scan history")
+        units = conn.execute("SELECT seq, office, discipline, project FROM units WHERE run_id = ? ORDER BY seq",
+                             (run_id,)).fetchall()
+        results = {}
+        for seq, path, *summary in conn.execute(
+            "SELECT r.seq, p.path, r.newest_mtime, r.recent_files, r.recent_bytes, r.newest_file FROM results r "
+            "JOIN paths p ON p.id = r.path_id WHERE r.run_id = ? ORDER BY r.seq, r.rowid", (run_id,)
+        ):
+            results.setdefault(seq, []).append((path, summary))
+    finally:
+        conn.close()
+
+    offices = json.loads(row[0]) + [office for _, office, _, _ in units if office not in json.loads(row[0])]
+    summaries = None
+    if row[2]:
+        summaries = {
+            path: dict(zip(["newest_mtime", "recent_files", "recent_bytes", "newest_file"], summary))
+            for paths in results.values() for path, summary in paths if summary[0] is not None
+        }
+    master_dict = filescan.new_master_dict(dict.fromkeys(offices), json.loads(row[1]))
+    with filescan.ScanResultWriter(master_dict, csv_path, json_path, jsonl_path, summaries) as writer:
+        for seq, office, discipline, project in units:
+            writer.write(office, discipline, project, [path for path, _ in results.get(seq, [])])
+    return writer.n_rows
+
+
+def get_date_from_csv_name(csv_path: str) -> datetime.datetime | None:
+    """Returns the date in an old output's name, e.g. recently_issued_folders_250324.csv, or None."""
+    match = re.search(r"_(\d{6})$", os.path.splitext(os.path.basename(csv_path))[0])
+    try:
+        return datetime.datetime.strptime(match.group(1), "%y%m%d") if match else None
+    except ValueError:
+        return None
+
+
+def import_csv(history_path: str, csv_path: str, started: datetime.datetime | None = None) -> int:
+    """Adds the results in an earlier run's CSV output to the history. Returns the new run's id."""
+    # The run's date is taken from the file name (see get_date_from_csv_name), or else from the file's mtime.
+    # Older outputs have no Project Number column, so the project number is read from the path.
+    import filescan
+    if started is None:
+        started = get_date_from_csv_name(csv_path) or datetime.datetime.fromtimestamp(os.path.getmtime(csv_path))
+    with open(csv_path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row.get("Path")]
+    for row in rows:
+        if not row.get("Project Number"):
+            # Paths from the share use backslashes, whichever system the import runs on
+            row["Project Number"] = filescan.get_project_number_from_path(row["Path"].replace("\\", "/"))
+    offices = list(dict.fromkeys(row["Office"] for row in rows))
+    disciplines = list(dict.fromkeys(row["Discipline"] for row in rows))
+    run = HistoryRun(history_path, started, None, offices, disciplines, status="imported")
+    try:
+        # Consecutive rows of the same project were written from one RCRD CPY tree
+        unit, paths = None, []
+        for row in rows + [None]:
+            key = None if row is None else (row["Office"], row["Discipline"], row["Project Number"])
+            if key != unit and unit is not None:
+                run.add(*unit, paths)
+                paths = []
+            unit = key
+            if row is not None:
+                paths.append(row["Path"])
+        run.finish(len(rows), status="imported")
+    finally:
+        run.close()
+    return run.run_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the history of filescan.py runs.")
+    parser.add_argument("--history", default=HISTORY_PATH, help="The scan history database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="List the stored runs")
+    new_parser = subparsers.add_parser("new", help="Folders matched in a run but not in the run before it")
+    new_parser.add_argument("--run", type=int, help="Run id (default: the latest finished run)")
+    streak_parser = subparsers.add_parser("streak", help="Folders matched in each of the last N runs")
+    streak_parser.add_argument("n", type=int)
+    streak_parser.add_argument("--run", type=int, help="Count back from this run (default: the latest finished run)")
+    trend_parser = subparsers.add_parser("trend", help="Matched folders of a project in each run")
+    trend_parser.add_argument("project")
+    trend_parser.add_argument("--office")
+    trend_parser.add_argument("--discipline")
+    export_parser = subparsers.add_parser("export", help="Write a run as recently_issued_folders.csv and .json")
+    export_parser.add_argument("run", type=int)
+    export_parser.add_argument("--csv", default="recently_issued_folders.csv")
+    export_parser.add_argument("--json", default="recently_issued_folders.json")
+    export_parser.add_argument("--jsonl")
+    import_parser = subparsers.add_parser("import", help="Add the CSV outputs of earlier runs to the history")
+    import_parser.add_argument("csv", nargs="+")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    if args.command == "runs":
+        for run_id, started, cutoff_date, status, n_rows in get_runs(args.history):
+            print(f"{run_id:6d}  {started}  cutoff {cutoff_date or '-':19s}  {status:9s}  {n_rows if n_rows is not None else '-'} rows")
+    elif args.command == "new":
+        for office, discipline, project, path in new_since_previous(args.history, args.run):
+            print(f"{office},{discipline},{project},{path}")
+    elif args.command == "streak":
+        for path in active_in_consecutive_runs(args.history, args.n, args.run):
+            print(path)
+    elif args.command == "trend":
+        for run_id, started, n_folders, recent_files, recent_bytes in project_trend(
+            args.history, args.project, args.office, args.discipline
+        ):
+            activity = f"  {recent_files} recent files, {recent_bytes} bytes" if recent_files is not None else ""
+            print(f"{run_id:6d}  {started}  {n_folders} folders{activity}")
+    elif args.command == "export":
+        n_rows = export_run(args.history, args.run, args.csv, args.json, args.jsonl)
+        logging.info(f"Exported run {args.run}: {n_rows} rows to {args.csv} and {args.json}")
+    elif args.command == "import":
+        for csv_path in args.csv:
+            run_id = import_csv(args.history, csv_path)
+            logging.info(f"Imported {csv_path} as run {run_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os, datetime, logging
+import sqlite3
+import time
+from typing import Iterator
+
+# The scan index is a small SQLite database that remembers, for every directory under the scanned
+# RCRD CPY folders, the directory's own mtime and the newest file found directly inside it.
+# On the next run, a directory whose mtime has not changed is answered from the index instead of
+# being listed again, so an unchanged RCRD CPY tree costs one stat per directory rather than one
+# listing per directory plus one stat per file.
+#
+# A directory's mtime only changes when entries are added, removed or renamed inside it, which is
+# what happens when an issue is copied into RCRD CPY. A file that is edited in place does not change
+# its parent's mtime, so run a refresh (refresh=True) every night to relist everything and keep the
+# index honest. Ad-hoc queries for any cutoff can then be answered from the index with query_index.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL,                 -- NULL until the directory has been listed successfully
+    newest_file_mtime REAL,     -- NULL if the directory holds no files
+    newest_file TEXT,
+    scanned_at REAL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE INDEX IF NOT EXISTS dirs_newest ON dirs (newest_file_mtime);
+"""
+
+
+def open_index(index_path: str) -> sqlite3.Connection:
+    """Opens (and if needed creates) the scan index database."""
+    # WAL mode lets parallel scans read the index while another scan is writing its results.
+    # The timeout makes concurrent writers wait for each other instead of failing.
+    conn = sqlite3.connect(index_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def subtree_bounds(path: str) -> tuple[str, str]:
+    """Returns the (low, high) string bounds that contain every path below the given directory."""
+    # Comparing against these bounds avoids LIKE, where the underscores in folder names such as
+    # 250722_01_IFC would act as wildcards.
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
+
+def delete_subtree(conn: sqlite3.Connection, path: str):
+    """Removes a directory and everything below it from the index."""
+    low, high = subtree_bounds(path)
+    conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (path, low, high))
+
+
+def list_directory_files(directory: str) -> tuple[float | None, str | None, list[str], dict]:
+    """Lists one directory for the index. Returns (newest file mtime, newest file, subdirectories, counts)."""
+    # The newest file is None if the directory holds no files. counts holds the filesystem calls made.
+    # The subdirectories are sorted the same way as the ones answered from the index (ORDER BY path),
+    # so a tree is walked, and its results come out, in the same order whether or not it has changed.
+    counts = {"scandir_calls": 1, "stat_calls": 0, "files_visited": 0}
+    newest_mtime, newest_file = None, None
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                counts["files_visited"] += 1
+                counts["stat_calls"] += 1
+                file_mtime = entry.stat().st_mtime
+                if newest_mtime is None or file_mtime > newest_mtime:
+                    newest_mtime, newest_file = file_mtime, entry.path
+            elif entry.is_dir():
+                subdirs.append(entry.path)
+    return newest_mtime, newest_file, sorted(subdirs), counts
+
+
+def walk_index(conn: sqlite3.Connection, root: str, list_dir, refresh: bool = False, columns: tuple = (),
+               skip_dir=None, call=None, counts: dict | None = None, new_children: list | None = None,
+               removed_dirs: list | None = None, timed_out: list | None = None) -> Iterator[tuple]:
+    """Walks a directory tree, listing again only the directories whose mtime differs from the index.
+
+    Yields (directory, mtime, listing, row) for every directory reached."""
+    # conn is an index with a dirs (path, parent, mtime, ...) table, such as the scan index or the find.py
+    # file name index. Every directory is stat'ed. A directory whose mtime matches the index (unless refresh
+    # is True) is not listed again: listing is None, row holds its stored values of the given columns, and
+    # its subdirectories are taken from the index. Any other directory is listed with list_dir(directory),
+    # which returns (subdirectories, listing), and row is None.
+    # Subdirectories not in the index yet are added to new_children as (path, parent), and directories
+    # that have gone to removed_dirs. skip_dir and call are as for scan_directory_incremental.
+    # Directories that cannot be stat'ed or listed are skipped and left as they are in the index. Those
+    # that fail with an OSError other than PermissionError or FileNotFoundError (such as TimeoutError)
+    # are added to timed_out. dirs_visited, stat_calls and the skipped directories are added to counts.
+    call = call or (lambda func, *args: func(*args))
+    counts = {} if counts is None else counts
+    new_children = [] if new_children is None else new_children
+    removed_dirs = [] if removed_dirs is None else removed_dirs
+    row_sql = f"SELECT {', '.join(('mtime',) + tuple(columns))} FROM dirs WHERE path = ?"
+    stack = [root]
+    while stack:
+        current_dir = stack.pop()
+        counts["dirs_visited"] = counts.get("dirs_visited", 0) + 1
+        try:
+            counts["stat_calls"] = counts.get("stat_calls", 0) + 1
+            dir_mtime = call(os.stat, current_dir).st_mtime
+            row = conn.execute(row_sql, (current_dir,)).fetchone()
+            known_subdirs = [path for (path,) in conn.execute(
+                "SELECT path FROM dirs WHERE parent = ? ORDER BY path", (current_dir,)
+            )]
+
+            if row is not None and not refresh and row[0] == dir_mtime:
+                # Unchanged since the last listing: answer from the index
+                listing, row, subdirs = None, row[1:], known_subdirs
+            else:
+                subdirs, listing = call(list_dir, current_dir)
+                row = None
+                known = set(known_subdirs)
+                new_children.extend((path, current_dir) for path in subdirs if path not in known)
+                removed_dirs.extend(known.difference(subdirs))
+        except PermissionError:
+            logging.warning(f"Permission denied: {current_dir}, skipping.")
+            counts["permission_denied"] = counts.get("permission_denied", 0) + 1
+            continue
+        except FileNotFoundError:
+            logging.warning(f"Directory not found: {current_dir}, skipping.")
+            counts["not_found"] = counts.get("not_found", 0) + 1
+            removed_dirs.append(current_dir)
+            continue
+        except OSError as e:
+            logging.warning(f"Could not list {current_dir}, skipping: {e}")
+            if timed_out is not None:
+                timed_out.append(current_dir)
+            continue
+
+        yield current_dir, dir_mtime, listing, row
+        stack.extend(path for path in subdirs if not (skip_dir and skip_dir(path)))
+
+
+def list_directory_for_index(directory: str) -> tuple[list[str], tuple]:
+    """Lists one directory for walk_index: (subdirectories, (newest file mtime, newest file, counts))."""
+    newest_mtime, newest_file, subdirs, counts = list_directory_files(directory)
+    return subdirs, (newest_mtime, newest_file, counts)
+
+
+def scan_directory_incremental(rcrd_cpy_dir: str, cutoff_date: datetime.datetime, index_path: str,
+                               refresh: bool = False, skip_dir=None, report: dict | None = None,
+                               newest_mtimes: dict | None = None, call=None, timed_out: list | None = None) -> list:
+    """Scans a RCRD CPY directory using the scan index and returns the directories with recently modified files."""
+    # The input to this function is a single RCRD CPY directory, a cutoff date and the path to the index.
+    # Every directory in the tree is stat'ed. Only directories whose mtime differs from the one stored
+    # in the index (or that are not in the index yet) are listed; the rest are answered from the index.
+    # If refresh is True, every directory is listed again regardless of its mtime.
+    # skip_dir is an optional function that is given a subdirectory path and returns True to skip it.
+    # Filesystem call counts are added to the report dict if one is given.
+    # If a newest_mtimes dict is given, the newest file mtime of each returned directory is added to it.
+    # call is an optional function call(func, *args) that every stat and listing goes through, e.g. to give
+    # it a timeout. Directories whose stat or listing fails with any other OSError (such as TimeoutError)
+    # are skipped, left as they are in the index and added to the timed_out list if one is given.
+    # The index is only written at the end, in one short transaction, so parallel scans do not hold
+    # the database lock while they wait on the network.
+
+    conn = open_index(index_path)
+    cutoff_ts = cutoff_date.timestamp()
+    modified_dirs = {} # {directory: newest file mtime}, in traversal order
+    updated_rows = []  # (path, parent, mtime, newest_file_mtime, newest_file, scanned_at)
+    new_children = []  # (path, parent) for subdirectories seen for the first time
+    removed_dirs = []  # Directories that have disappeared since the last run
+    counts = {"scandir_calls": 0, "stat_calls": 0, "dirs_visited": 0, "files_visited": 0,
+              "index_hits": 0, "permission_denied": 0, "not_found": 0}
+    try:
+        for current_dir, dir_mtime, listing, row in walk_index(
+            conn, rcrd_cpy_dir, list_directory_for_index, refresh, ("newest_file_mtime", "newest_file"),
+            skip_dir, call, counts, new_children, removed_dirs, timed_out
+        ):
+            if listing is None:
+                counts["index_hits"] += 1
+                newest_mtime, newest_file = row
+            else:
+                newest_mtime, newest_file, listing_counts = listing
+                for key, value in listing_counts.items():
+                    counts[key] += value
+                updated_rows.append((current_dir, os.path.dirname(current_dir), dir_mtime,
+                                     newest_mtime, newest_file, time.time()))
+
+            if newest_mtime is not None and newest_mtime >= cutoff_ts:
+                modified_dirs[current_dir] = newest_mtime
+                logging.info(f"Modified file found: {newest_file}")
+
+        with conn:
+            for path in removed_dirs:
+                delete_subtree(conn, path)
+            # New subdirectories get a row with no mtime so they are listed even if this scan
+            # could not reach them (e.g. permission denied), instead of being forgotten.
+            conn.executemany("INSERT OR IGNORE INTO dirs (path, parent) VALUES (?, ?)", new_children)
+            conn.executemany(
+                "INSERT OR REPLACE INTO dirs (path, parent, mtime, newest_file_mtime, newest_file, scanned_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", updated_rows
+            )
+        logging.info(f"Index scan of {rcrd_cpy_dir}: listed {len(updated_rows)} changed directories")
+        if newest_mtimes is not None:
+            newest_mtimes.update(modified_dirs)
+        return list(modified_dirs)
+    finally:
+        conn.close()
+        if report is not None:
+            for key, value in counts.items():
+                report[key] = report.get(key, 0) + value
+
+
+def query_index(index_path: str, cutoff_date: datetime.datetime, root: str | None = None) -> list:
+    """Returns the indexed directories that hold a file modified since the cutoff date, without touching the share."""
+    # If root is given, only directories at or below root are returned.
+    conn = open_index(index_path)
+    try:
+        sql = "SELECT path FROM dirs WHERE newest_file_mtime >= ?"
+        params: list = [cutoff_date.timestamp()]
+        if root is not None:
+            low, high = subtree_bounds(root)
+            sql += " AND (path = ? OR (path >= ? AND path < ?))"
+            params += [root, low, high]
+        return [path for (path,) in conn.execute(sql + " ORDER BY path", params)]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    # Answer an ad-hoc query from the index, e.g. python scan_index.py scan_index.sqlite 7
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    index_path, days = sys.argv[1], float(sys.argv[2])
+    root = sys.argv[3] if len(sys.argv) > 3 else None
+    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+    for path in query_index(index_path, cutoff_date, root):
+        print(path)
@@ -0,0 +1,242 @@
+### Sharded scans for filescan.py.
+### Splits a company-wide scan into shards (one per office, or one per project group within each office),
+### runs them in separate processes or separate invocations, and merges the partial results into the
+### usual recently_issued_folders.json and .csv.
+### Each shard writes a self-describing partial result file, so a failed shard can be re-run on its own.
+
+### Workflow:
+# 1 - python scan_shards.py plan --offices SSC SYD GLC --by group   (fixes the shards and the cutoff date)
+# 2 - python scan_shards.py run --processes 4                       (runs every shard that is not complete yet)
+#     python scan_shards.py run --shard SYD-27000                   (or run a single shard, e.g. on another machine)
+# 3 - python scan_shards.py status                                  (shows which shards are complete)
+# 4 - python scan_shards.py merge                                   (writes the JSON and CSV outputs)
+
+import os, datetime, logging
+import argparse
+import json
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import filescan
+
+SHARD_DIR = "shards"
+SHARD_FORMAT = "filescan-shard"
+SHARD_VERSION = 2
+
+
+def write_json_atomic(path: str, data: dict):
+    """Writes JSON to a temporary file first, so a killed run never leaves a half-written file behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def plan_shards(base_dir: str, offices: list, disciplines: list, ind_projects_to_scan: dict, days_threshold: float,
+                by: str = "office") -> dict:
+    """Returns a shard plan: the settings shared by every shard, and one entry per shard."""
+    # by is "office" for one shard per office, or "group" for one shard per project group (e.g. SSC-25000).
+    # The cutoff date is fixed here, so shards that are re-run later still produce mergeable results.
+    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days_threshold)
+    shards = []
+    for office, office_dir in filescan.get_office_dirs(base_dir, offices).items():
+        if by == "group":
+            for group_dir in filescan.get_subdirectories(office_dir, filter_digits=5):
+                shards.append({"id": f"{office}-{os.path.basename(group_dir)}", "office": office, "groups": [group_dir]})
+        else:
+            shards.append({"id": office, "office": office, "groups": None})
+    ind_projects = {office: projects for office, projects in ind_projects_to_scan.items() if office not in offices}
+    if any(ind_projects.values()):
+        shards.append({"id": "IND", "office": None, "groups": None, "ind_projects_to_scan": ind_projects})
+    return {
+        "format": f"{SHARD_FORMAT}-plan",
+        "version": SHARD_VERSION,
+        "base_dir": base_dir,
+        "offices": offices,
+        "disciplines": disciplines,
+        "days_threshold": days_threshold,
+        "cutoff_date": cutoff_date.isoformat(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "shards": shards,
+    }
+
+
+def get_shard_records(plan: dict, shard: dict) -> list[filescan.ProjectDiscipline]:
+    """Returns the records (see filescan.walk_project_tree) of one shard, in the order of the output files."""
+    if shard.get("ind_projects_to_scan"):
+        offices, ind_projects_to_scan, office_groups = [], shard["ind_projects_to_scan"], None
+    else:
+        offices, ind_projects_to_scan = [shard["office"]], {}
+        office_groups = None if shard["groups"] is None else {shard["office"]: shard["groups"]}
+    records = filescan.walk_project_tree(plan["base_dir"], offices, ind_projects_to_scan, plan["disciplines"],
+                                         filescan.discovery_concurrency, office_groups=office_groups)
+    return filescan.sort_records(records, filescan.get_scan_offices(offices, ind_projects_to_scan), plan["disciplines"])
+
+
+def shard_path(shard_dir: str, shard_id: str) -> str:
+    return os.path.join(shard_dir, f"{shard_id}.json")
+
+
+def run_shard(plan: dict, shard: dict, shard_dir: str, scan_options: dict | None = None) -> str:
+    """Scans one shard and writes its partial result file. Returns the shard's status."""
+    # The partial result file repeats the plan settings, so it can be checked and merged on its own.
+    started = time.time()
+    partial = {
+        "format": SHARD_FORMAT,
+        "version": SHARD_VERSION,
+        "shard": shard,
+        "base_dir": plan["base_dir"],
+        "disciplines": plan["disciplines"],
+        "cutoff_date": plan["cutoff_date"],
+        "started": datetime.datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "summarise": bool((scan_options or {}).get("summarise")), # Whether the report holds activity summaries
+    }
+    try:
+        cutoff_date = datetime.datetime.fromisoformat(plan["cutoff_date"])
+        records = get_shard_records(plan, shard)
+        offices = list(dict.fromkeys(record.office for record in records))
+        report = {}
+        # Each row also says whether it is for a sub-project, so merge_shards can put the rows of all
+        # shards in the same order as filescan.py (see filescan.sort_records for the order of the units)
+        results = [
+            [office, discipline, proj_no, mod_dirs, record.sub_project is not None]
+            for record, (office, discipline, proj_no, mod_dirs) in zip(records, filescan.iter_record_scan_results(
+                records, offices, plan["disciplines"], cutoff_date, workers=filescan.scan_workers,
+                scan_options=scan_options, report=report))
+            if mod_dirs or filescan.json_empty_projects
+        ]
+        report.pop("trees", None)
+        partial.update(status="complete", report=report, results=results)
+    except Exception as e:
+        logging.warning(f"Shard {shard['id']} failed: {e}")
+        partial.update(status="failed", error=str(e))
+    partial["seconds"] = time.time() - started
+    write_json_atomic(shard_path(shard_dir, shard["id"]), partial)
+    logging.info(f"Shard {shard['id']} {partial['status']} in {partial['seconds']:.1f}s")
+    return partial["status"]
+
+
+def read_shard(shard_dir: str, plan: dict, shard_id: str) -> dict | None:
+    """Returns a shard's partial result if it is complete and belongs to the plan, otherwise None."""
+    try:
+        with open(shard_path(shard_dir, shard_id)) as f:
+            partial = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if (partial.get("format") != SHARD_FORMAT or partial.get("version") != SHARD_VERSION or partial.get("status") != "complete"
+            or partial.get("cutoff_date") != plan["cutoff_date"] or partial.get("disciplines") != plan["disciplines"]):
+        return None
+    return partial
+
+
+def pending_shards(plan: dict, shard_dir: str) -> list[dict]:
+    """Returns the shards of the plan that have no complete partial result yet."""
+    return [shard for shard in plan["shards"] if read_shard(shard_dir, plan, shard["id"]) is None]
+
+
+def run_shards(plan: dict, shard_dir: str, shard_ids: list[str] | None = None, processes: int = 1,
+               scan_options: dict | None = None) -> dict[str, str]:
+    """Runs the given shards (default: every shard that is not complete) and returns {shard id: status}."""
+    if shard_ids:
+        unknown = set(shard_ids).difference(shard["id"] for shard in plan["shards"])
+        if unknown:
+            raise ValueError(f"Unknown shards: {sorted(unknown)}")
+        shards = [shard for shard in plan["shards"] if shard["id"] in shard_ids]
+    else:
+        shards = pending_shards(plan, shard_dir)
+    logging.info(f"Running {len(shards)} shards with {processes} processes")
+    if processes > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            statuses = list(executor.map(run_shard, [plan] * len(shards), shards, [shard_dir] * len(shards),
+                                         [scan_options] * len(shards)))
+    else:
+        statuses = [run_shard(plan, shard, shard_dir, scan_options) for shard in shards]
+    return dict(zip([shard["id"] for shard in shards], statuses))
+
+
+def merge_shards(plan: dict, shard_dir: str, csv_path: str, json_path: str, jsonl_path: str | None = None) -> int:
+    """Combines the partial results of every shard into the usual JSON and CSV outputs. Returns the number of rows."""
+    # Every shard must be complete, otherwise the output would silently miss projects.
+    partials = [read_shard(shard_dir, plan, shard["id"]) for shard in plan["shards"]]
+    missing = [shard["id"] for shard, partial in zip(plan["shards"], partials) if partial is None]
+    if missing:
+        raise RuntimeError(f"Shards not complete: {missing}. Run them with: python scan_shards.py run")
+
+    # Write the rows out in the same order as filescan.py: office -> discipline -> projects, then sub-projects.
+    # The shards are in plan order, so sorting the rows of all shards by that key (keeping the order
+    # of rows that compare equal) gives the projects of every project group before any sub-project.
+    offices = list(plan["offices"]) + [
+        office for partial in partials for office, *_ in partial["results"] if office not in plan["offices"]
+    ]
+    office_order = {office: i for i, office in enumerate(dict.fromkeys(offices))}
+    discipline_order = {discipline: i for i, discipline in enumerate(plan["disciplines"])}
+    report = {}
+    for partial in partials:
+        filescan.merge_scan_report(report, partial["report"])
+    rows = sorted((row for partial in partials for row in partial["results"]),
+                  key=lambda row: (office_order[row[0]], discipline_order[row[1]], row[4]))
+    scan_results = ((office, discipline, proj_no, mod_dirs) for office, discipline, proj_no, mod_dirs, _ in rows)
+    # The summary columns are written if the shards were run with activity summaries, whatever the current settings
+    summarised = {partial.get("summarise", False) for partial in partials}
+    if len(summarised) > 1:
+        raise RuntimeError("Some shards were run with activity summaries and some without. "
+                           "Re-run them all with the same settings: python scan_shards.py run --shard ...")
+    summaries = report.get("summaries", {}) if True in summarised else None
+    n_rows = filescan.write_scan_results(scan_results, filescan.new_master_dict(office_order, plan["disciplines"]),
+                                         csv_path, json_path, jsonl_path, summaries, filescan.json_empty_projects)
+    logging.info(f"Merged {len(partials)} shards: {n_rows} rows. Scan counts: "
+                 f"{ {k: v for k, v in report.items() if isinstance(v, (int, float))} }")
+    filescan.write_incomplete_trees(os.path.join(os.path.dirname(csv_path), "incomplete_trees.csv"),
+                                    report.get("incomplete", []))
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run filescan.py as separate shards and merge the results.")
+    parser.add_argument("--dir", default=SHARD_DIR, help="Directory for the plan and the partial result files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="Decide the shards and the cutoff date")
+    plan_parser.add_argument("--base-dir", default=filescan.base_dir)
+    plan_parser.add_argument("--offices", nargs="+", default=filescan.offices)
+    plan_parser.add_argument("--disciplines", nargs="+", default=filescan.disciplines)
+    plan_parser.add_argument("--days", type=float, default=filescan.days_threshold)
+    plan_parser.add_argument("--by", choices=["office", "group"], default="office")
+    run_parser = subparsers.add_parser("run", help="Run shards that are not complete yet")
+    run_parser.add_argument("--shard", nargs="+", help="Run only these shards, even if they are complete")
+    run_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    subparsers.add_parser("status", help="Show which shards are complete")
+    merge_parser = subparsers.add_parser("merge", help="Combine the shards into the usual outputs")
+    merge_parser.add_argument("--csv", default="recently_issued_folders.csv")
+    merge_parser.add_argument("--json", default="recently_issued_folders.json")
+    args = parser.parse_args()
+
+    plan_path = os.path.join(args.dir, "plan.json")
+    if args.command == "plan":
+        os.makedirs(args.dir, exist_ok=True)
+        plan = plan_shards(args.base_dir, args.offices, args.disciplines, filescan.ind_projects_to_scan, args.days, args.by)
+        write_json_atomic(plan_path, plan)
+        logging.info(f"Planned {len(plan['shards'])} shards with cutoff {plan['cutoff_date']} in {plan_path}")
+        return
+
+    with open(plan_path) as f:
+        plan = json.load(f)
+    if args.command == "run":
+        statuses = run_shards(plan, args.dir, args.shard, args.processes, filescan.get_scan_options())
+        failed = [shard_id for shard_id, status in statuses.items() if status != "complete"]
+        if failed:
+            logging.warning(f"Failed shards: {failed}. Re-run them with: python scan_shards.py run --shard {' '.join(failed)}")
+    elif args.command == "status":
+        pending = {shard["id"] for shard in pending_shards(plan, args.dir)}
+        for shard in plan["shards"]:
+            print(f"{shard['id']:20s} {'pending' if shard['id'] in pending else 'complete'}")
+    elif args.command == "merge":
+        try:
+            merge_shards(plan, args.dir, args.csv, args.json, filescan.output_jsonl)
+        except RuntimeError as e:
+            logging.error(e)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+### Watch mode for filescan.py.
+### Does one full scan of the RCRD CPY trees, then keeps the results current from filesystem change
+### notifications (inotify on Linux) or, where those are not available, by polling directory mtimes.
+### The newest file mtime of every directory is kept in memory, so "modified in the last N days" can be
+### answered for any N straight away, without rescanning.
+
+### Usage:
+# python scan_watch.py serve --base-dir test_dirs --offices SSC GLC --disciplines CVL STR
+# python scan_watch.py query 7              (prints the CSV rows for the last 7 days)
+# python scan_watch.py query 7 --format json
+
+import os, datetime, logging
+import argparse
+import csv
+import ctypes
+import ctypes.util
+import json
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import filescan
+
+WATCH_HOST = "127.0.0.1"
+WATCH_PORT = 8765
+POLL_INTERVAL = 30 # Seconds between checks of directory mtimes when polling
+FULL_RESCAN_INTERVAL = 6 * 3600 # Seconds between full rescans, which also pick up new projects and in-place edits. 0 disables.
+
+
+class ScanState:
+    """The newest file mtime of every directory in every scanned RCRD CPY tree, kept current by a watcher."""
+
+    def __init__(self, base_dir: str, offices: list, disciplines: list, ind_projects_to_scan: dict, workers: int = 16):
+        self.base_dir = base_dir
+        self.offices = offices
+        self.disciplines = disciplines
+        self.ind_projects_to_scan = ind_projects_to_scan
+        self.workers = workers
+        self.lock = threading.RLock()
+        self.units = [] # (office, discipline, project_number, rcrd_cpy_dir or None), in output order
+        self.trees = {} # {rcrd_cpy_dir: {directory: newest file mtime}}, directories in walk order
+        self.tree_of_dir = {} # {directory: rcrd_cpy_dir}
+        self.children = {} # {directory: set of subdirectories}
+        self.scanned_at = None
+
+    def rescan(self):
+        """Discovers the projects and walks every RCRD CPY tree again, replacing the current state."""
+        started = time.time()
+        records = filescan.sort_records(
+            filescan.walk_project_tree(self.base_dir, self.offices, self.ind_projects_to_scan, self.disciplines,
+                                       filescan.discovery_concurrency),
+            filescan.get_scan_offices(self.offices, self.ind_projects_to_scan), self.disciplines)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Only projects that have a folder for the discipline are checked for a RCRD CPY directory
+            rcrd_cpy_dirs = list(executor.map(
+                lambda record: record.discipline_dir and filescan.get_rcrd_cpy_dirs(
+                    os.path.basename(record.discipline_dir), record.project_dir),
+                records))
+            trees = dict(zip(
+                [d for d in rcrd_cpy_dirs if d],
+                executor.map(filescan.get_newest_mtimes, [d for d in rcrd_cpy_dirs if d]),
+            ))
+
+        with self.lock:
+            self.units = [
+                (record.office, record.discipline, record.project, rcrd_cpy_dir)
+                for record, rcrd_cpy_dir in zip(records, rcrd_cpy_dirs)
+            ]
+            self.trees, self.tree_of_dir, self.children = {}, {}, {}
+            for rcrd_cpy_dir, newest_mtimes in trees.items():
+                self.trees[rcrd_cpy_dir] = {}
+                self._add_dirs(rcrd_cpy_dir, newest_mtimes)
+            self.scanned_at = started
+        logging.info(f"Scanned {len(trees)} RCRD CPY trees with {len(self.tree_of_dir)} directories "
+                     f"in {time.time() - started:.1f}s")
+
+    def _add_dirs(self, rcrd_cpy_dir: str, newest_mtimes: dict):
+        # Must be called with the lock held
+        tree = self.trees[rcrd_cpy_dir]
+        for directory, newest_mtime in newest_mtimes.items():
+            tree[directory] = newest_mtime
+            self.tree_of_dir[directory] = rcrd_cpy_dir
+            self.children.setdefault(directory, set())
+            if directory != rcrd_cpy_dir:
+                self.children.setdefault(os.path.dirname(directory), set()).add(directory)
+
+    def remove_subtree(self, directory: str):
+        """Forgets a directory and everything below it."""
+        with self.lock:
+            rcrd_cpy_dir = self.tree_of_dir.get(directory)
+            if rcrd_cpy_dir is None:
+                return
+            stack = [directory]
+            while stack:
+                current_dir = stack.pop()
+                stack.extend(self.children.pop(current_dir, ()))
+                self.trees[rcrd_cpy_dir].pop(current_dir, None)
+                self.tree_of_dir.pop(current_dir, None)
+            self.children.get(os.path.dirname(directory), set()).discard(directory)
+
+    def refresh_dir(self, directory: str) -> list[str]:
+        """Lists one directory again and updates the state. Returns the directories that are new to the state."""
+        with self.lock:
+            rcrd_cpy_dir = self.tree_of_dir.get(directory)
+            known_subdirs = set(self.children.get(directory, ()))
+        if rcrd_cpy_dir is None:
+            return []
+        try:
+            newest_mtime, _, subdirs = filescan.list_directory(directory)
+        except FileNotFoundError:
+            self.remove_subtree(directory)
+            return []
+        except PermissionError:
+            logging.warning(f"Permission denied: {directory}, skipping.")
+            return []
+
+        # Walk new subdirectories outside the lock, as they may be large
+        new_mtimes = {directory: newest_mtime}
+        for subdir in subdirs:
+            if subdir not in known_subdirs:
+                new_mtimes.update(filescan.get_newest_mtimes(subdir))
+        for subdir in known_subdirs.difference(subdirs):
+            self.remove_subtree(subdir)
+        with self.lock:
+            if rcrd_cpy_dir not in self.trees:
+                return [] # Replaced by a rescan in the meantime
+            self._add_dirs(rcrd_cpy_dir, new_mtimes)
+        return [d for d in new_mtimes if d != directory]
+
+    def all_dirs(self) -> list[str]:
+        with self.lock:
+            return list(self.tree_of_dir)
+
+    def query(self, cutoff_date: datetime.datetime) -> dict:
+        """Returns the master dictionary for the given cutoff date: {office: {discipline: {project_number: [paths]}}}"""
+        cutoff_ts = cutoff_date.timestamp()
+        with self.lock:
+            master_dict = filescan.new_master_dict(filescan.get_scan_offices(self.offices, self.ind_projects_to_scan),
+                                                   self.disciplines)
+            for office, discipline, proj_no, rcrd_cpy_dir in self.units:
+                tree = self.trees.get(rcrd_cpy_dir, {}) if rcrd_cpy_dir else {}
+                mod_dirs = [d for d, newest_mtime in tree.items() if newest_mtime is not None and newest_mtime >= cutoff_ts]
+                filescan.add_to_master_dict(master_dict, office, discipline, proj_no, mod_dirs)
+        return master_dict
+
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, name length
+
+
+class InotifyWatcher:
+    """Keeps a ScanState current from Linux inotify events. Only works for local filesystems."""
+
+    def __init__(self, state: ScanState):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.state = state
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {} # {watch descriptor: directory}
+
+    def add_watches(self, directories: list[str]):
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno == 28: # ENOSPC: out of watches (see fs.inotify.max_user_watches)
+                    raise OSError(errno, "Too many directories for inotify; raise fs.inotify.max_user_watches")
+                logging.warning(f"Cannot watch {directory}: {os.strerror(errno)}")
+                continue
+            self.paths[wd] = directory
+
+    def read_events(self, timeout: float) -> list[tuple[str, int, str]]:
+        """Waits up to timeout seconds and returns the pending events as (directory, mask, name)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 256 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((self.paths.get(wd, ""), mask, name))
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+        return events
+
+    def run(self, stop: threading.Event, full_rescan_interval: float = FULL_RESCAN_INTERVAL):
+        self.add_watches(self.state.all_dirs())
+        logging.info(f"Watching {len(self.paths)} directories with inotify")
+        last_rescan = time.time()
+        while not stop.is_set():
+            # Events that arrive close together are handled as one batch, listing each directory once
+            dirty = {}
+            for directory, mask, name in self.read_events(timeout=1.0):
+                if mask & IN_Q_OVERFLOW:
+                    logging.warning("inotify queue overflowed, rescanning everything")
+                    last_rescan = 0
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.state.remove_subtree(directory)
+                elif directory:
+                    dirty[directory] = None
+            for directory in dirty:
+                self.add_watches(self.state.refresh_dir(directory))
+            if full_rescan_interval and time.time() - last_rescan > full_rescan_interval:
+                self.state.rescan()
+                self.add_watches(self.state.all_dirs())
+                last_rescan = time.time()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Keeps a ScanState current by checking every directory's mtime at a fixed interval."""
+    # A directory's mtime only changes when entries are added, removed or renamed, so files that are
+    # edited in place are picked up by the full rescan instead.
+
+    def __init__(self, state: ScanState, interval: float = POLL_INTERVAL):
+        self.state = state
+        self.interval = interval
+        self.dir_mtimes = {}
+
+    def poll(self):
+        """Checks every known directory once and lists the ones whose mtime has changed."""
+        for directory in self.state.all_dirs():
+            try:
+                dir_mtime = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                self.state.remove_subtree(directory)
+                self.dir_mtimes.pop(directory, None)
+                continue
+            except OSError as e:
+                logging.warning(f"Cannot check {directory}: {e}")
+                continue
+            previous = self.dir_mtimes.get(directory)
+            self.dir_mtimes[directory] = dir_mtime
+            # The first time a directory is seen, list it again only if it changed after the scan started
+            if (previous is None and dir_mtime >= self.state.scanned_at) or (previous is not None and dir_mtime != previous):
+                self.state.refresh_dir(directory)
+
+    def run(self, stop: threading.Event, full_rescan_interval: float = FULL_RESCAN_INTERVAL):
+        logging.info(f"Polling directories every {self.interval}s")
+        last_rescan = time.time()
+        while not stop.is_set():
+            self.poll()
+            if full_rescan_interval and time.time() - last_rescan > full_rescan_interval:
+                self.state.rescan()
+                last_rescan = time.time()
+            stop.wait(self.interval)
+
+    def close(self):
+        pass
+
+
+def make_watcher(state: ScanState, polling: bool = False, poll_interval: float = POLL_INTERVAL):
+    """Returns an inotify watcher where possible, otherwise a polling watcher."""
+    if not polling:
+        try:
+            return InotifyWatcher(state)
+        except OSError as e:
+            logging.info(f"inotify not available ({e}), falling back to polling")
+    return PollingWatcher(state, poll_interval)
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answers one query per connection. The request is a JSON line such as {"days": 7}."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=float(request["days"]))
+            response = {"cutoff": cutoff_date.isoformat(timespec="seconds"),
+                        "scanned_at": datetime.datetime.fromtimestamp(self.server.state.scanned_at).isoformat(timespec="seconds"),
+                        "results": self.server.state.query(cutoff_date)}
+        except Exception as e:
+            response = {"error": str(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class QueryServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, state: ScanState, host: str = WATCH_HOST, port: int = WATCH_PORT):
+        super().__init__((host, port), QueryHandler)
+        self.state = state
+
+
+def serve(state: ScanState, host: str = WATCH_HOST, port: int = WATCH_PORT, polling: bool = False,
+          poll_interval: float = POLL_INTERVAL, full_rescan_interval: float = FULL_RESCAN_INTERVAL,
+          stop: threading.Event | None = None):
+    """Scans everything, then keeps the state current and answers queries on host:port until stopped."""
+    stop = stop or threading.Event()
+    state.rescan()
+    watcher = make_watcher(state, polling, poll_interval)
+    server = QueryServer(state, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Answering queries on {host}:{server.server_address[1]}")
+    try:
+        try:
+            watcher.run(stop, full_rescan_interval)
+        except OSError as e:
+            # e.g. more directories than inotify watches allowed
+            if not isinstance(watcher, InotifyWatcher):
+                raise
+            logging.warning(f"inotify failed ({e}), falling back to polling")
+            watcher.close()
+            watcher = PollingWatcher(state, poll_interval)
+            watcher.run(stop, full_rescan_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        watcher.close()
+
+
+def query(days: float, host: str = WATCH_HOST, port: int = WATCH_PORT) -> dict:
+    """Asks a running watch server for the results of the last N days."""
+    with socket.create_connection((host, port)) as conn:
+        conn.sendall(json.dumps({"days": days}).encode() + b"\n")
+        response = json.loads(conn.makefile("rb").readline())
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep filescan.py results current and answer queries for any number of days.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Scan, then watch for changes and answer queries")
+    serve_parser.add_argument("--base-dir", default=filescan.base_dir)
+    serve_parser.add_argument("--offices", nargs="+", default=filescan.offices)
+    serve_parser.add_argument("--disciplines", nargs="+", default=filescan.disciplines)
+    serve_parser.add_argument("--polling", action="store_true", help="Poll directory mtimes instead of using inotify")
+    serve_parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    serve_parser.add_argument("--full-rescan-interval", type=float, default=FULL_RESCAN_INTERVAL)
+    serve_parser.add_argument("--port", type=int, default=WATCH_PORT)
+    query_parser = subparsers.add_parser("query", help="Ask a running server for the last N days")
+    query_parser.add_argument("days", type=float)
+    query_parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    query_parser.add_argument("--port", type=int, default=WATCH_PORT)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        ind_projects = {k: v for k, v in filescan.ind_projects_to_scan.items() if k not in args.offices}
+        state = ScanState(args.base_dir, args.offices, args.disciplines, ind_projects, filescan.scan_workers)
+        serve(state, port=args.port, polling=args.polling, poll_interval=args.poll_interval,
+              full_rescan_interval=args.full_rescan_interval)
+    else:
+        # Results only: keep the query's output clean of filescan's INFO logging
+        logging.getLogger().setLevel(logging.WARNING)
+        response = query(args.days, port=args.port)
+        if args.format == "json":
+            print(json.dumps(response["results"], indent=4))
+        else:
+            writer = csv.writer(sys.stdout, lineterminator="\n")
+            writer.writerow(filescan.CSV_COLUMNS)
+            for office, disciplines in response["results"].items():
+                for discipline, projects in disciplines.items():
+                    writer.writerows((office, discipline, proj_no, path) for proj_no, paths in projects.items() for path in paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os, logging
+import json
+import sqlite3
+import threading
+import time
+
+# The topology cache remembers the subdirectories of every directory looked at while finding the
+# project folders and their RCRD CPY folders (office -> project group -> project -> sub-project ->
+# discipline -> RCRD CPY). These barely change from week to week, so most runs can answer them
+# from the cache instead of listing thousands of directories on the share.
+#
+# Each cached listing stores the directory's mtime and when it was last checked:
+# - Within the TTL, the listing is used as it is, without touching the share.
+# - After the TTL, the directory is stat'ed. If its mtime has not changed, no folder has been added,
+#   removed or renamed inside it, so the cached listing is still right. Otherwise it is listed again.
+# A listing answers both ways: a project whose listing has no CVL folder is known to have no
+# CVL\RCRD CPY without another call. Directories that do not exist are cached as missing.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    path TEXT PRIMARY KEY,
+    mtime REAL,                 -- NULL if the directory did not exist when it was checked
+    subdirs TEXT,               -- JSON list of subdirectory names, in listing order
+    checked_at REAL
+);
+"""
+
+_local = threading.local() # One connection per thread and cache file, as discovery and scans run on thread pools
+
+
+def open_cache(cache_path: str) -> sqlite3.Connection:
+    """Returns this thread's connection to the topology cache, creating the cache if needed."""
+    connections = _local.__dict__.setdefault("connections", {})
+    conn = connections.get(cache_path)
+    if conn is None:
+        conn = sqlite3.connect(cache_path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        connections[cache_path] = conn
+    return conn
+
+
+def list_subdir_names(directory: str) -> list[str]:
+    with os.scandir(directory) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
+
+
+def get_subdir_names(directory: str, cache_path: str, ttl: float, counts: dict | None = None) -> list[str] | None:
+    """Returns the names of the subdirectories of a directory, or None if it does not exist, using the cache."""
+    # ttl is the number of seconds a cached listing is used without checking the directory's mtime.
+    # Filesystem calls and cache hits are added to counts if it is given.
+    # PermissionError and other OS errors are raised and not cached, so the directory is tried again next time.
+    counts = {} if counts is None else counts
+    conn = open_cache(cache_path)
+    now = time.time()
+    row = conn.execute("SELECT mtime, subdirs, checked_at FROM listings WHERE path = ?", (directory,)).fetchone()
+    if row is not None and now - row[2] < ttl:
+        counts["topology_hits"] = counts.get("topology_hits", 0) + 1
+        return None if row[0] is None else json.loads(row[1])
+
+    # The mtime is read before listing, so a change made during the listing is picked up next time
+    counts["stat_calls"] = counts.get("stat_calls", 0) + 1
+    try:
+        dir_mtime = os.stat(directory).st_mtime
+        if row is not None and row[0] == dir_mtime:
+            counts["topology_revalidated"] = counts.get("topology_revalidated", 0) + 1
+            with conn:
+                conn.execute("UPDATE listings SET checked_at = ? WHERE path = ?", (now, directory))
+            return json.loads(row[1])
+        counts["scandir_calls"] = counts.get("scandir_calls", 0) + 1
+        names = list_subdir_names(directory)
+    except (FileNotFoundError, NotADirectoryError):
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO listings (path, mtime, subdirs, checked_at) VALUES (?, NULL, NULL, ?)",
+                         (directory, now))
+        return None
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO listings (path, mtime, subdirs, checked_at) VALUES (?, ?, ?, ?)",
+                     (directory, dir_mtime, json.dumps(names), now))
+    return names
+
+
+def find_subdir(directory: str, name: str, cache_path: str, ttl: float, counts: dict | None = None) -> bool:
+    """Returns True if the directory has a subdirectory with the given name, using the cache."""
+    # Names are compared as the filesystem would (ignoring case on Windows), like os.path.isdir does.
+    names = get_subdir_names(directory, cache_path, ttl, counts)
+    return names is not None and os.path.normcase(name) in map(os.path.normcase, names)
+
+
+if __name__ == "__main__":
+    # Show what the cache holds, e.g. python topology_cache.py topology_cache.sqlite
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    conn = sqlite3.connect(sys.argv[1])
+    n_listings, n_missing, oldest = conn.execute(
+        "SELECT COUNT(*), SUM(mtime IS NULL), MIN(checked_at) FROM listings"
+    ).fetchone()
+    logging.info(f"{n_listings} cached directories, {n_missing or 0} missing, "
+                 f"oldest checked {time.time() - (oldest or time.time()):.0f}s ago")